@@ -0,0 +1,110 @@
+"""
+Dados sintéticos para os benchmarks, num schema isolado ("bench") com as
+mesmas tabelas e índices de public. As queries de utils/stats.py correm contra
+ele através de bench_connection(), que põe o schema à frente no search_path.
+"""
+from contextlib import contextmanager
+
+from utils import db as DB
+from utils import stats as StatsDB
+from utils import partitions as Partitions
+
+BENCH_SCHEMA = "bench"
+
+BENCH_TABLES = ["ev_station", "ev_session", "ev_session_daily"]
+
+
+@contextmanager
+def bench_connection():
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SET LOCAL search_path TO {BENCH_SCHEMA}, public")
+        cursor.close()
+        yield conn
+
+
+def create_bench_data(users, sessions, stations, clusters=5, partitioned=False):
+    # Sem INCLUDING DEFAULTS: o id vem do generate_series e não consome a sequência pública
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        for table in BENCH_TABLES:
+            cursor.execute(f"""
+                CREATE TABLE {BENCH_SCHEMA}.{table}
+                (LIKE public.{table} INCLUDING INDEXES INCLUDING CONSTRAINTS)
+            """)
+
+        cursor.execute(f"""
+            INSERT INTO {BENCH_SCHEMA}.ev_station (
+                station_id, distrito, concelho, freguesia, latitude, longitude,
+                potencia_max_kw, num_pontos_ligacao
+            )
+            SELECT
+                'ST' || s,
+                (ARRAY['Lisboa', 'Porto', 'Faro', 'Braga', 'Coimbra'])[1 + s %% 5],
+                'Concelho ' || (s %% 40),
+                'Freguesia ' || s,
+                38 + (s %% 300) / 100.0,
+                -9 + (s %% 200) / 100.0,
+                (ARRAY[7.4, 22, 50, 150])[1 + s %% 4],
+                1 + s %% 4
+            FROM generate_series(0, %(stations)s - 1) s
+        """, {"stations": stations})
+
+        # Inícios distintos garantem a unique_session; ~5% das sessões sem energia
+        cursor.execute(f"""
+            INSERT INTO {BENCH_SCHEMA}.ev_session (
+                id, user_id, vehicle_model, battery_capacity_kwh, station_id,
+                start_time, end_time, energy_consumed_kwh, duration_h,
+                charging_rate_kw, charging_cost_eur, time_of_day, day_of_week,
+                soc_start, soc_end, distance_driven_km, temperature_c, vehicle_age_years,
+                cluster_kmeans, cluster_dbscan, clustering_timestamp
+            )
+            SELECT
+                g,
+                'User_' || (1 + (hashint %% %(users)s)),
+                'Model ' || (hashint %% 7),
+                40 + (hashint %% 4) * 20,
+                'ST' || ((hashint / 7) %% %(stations)s),
+                ts,
+                ts + INTERVAL '2 hours',
+                CASE WHEN hashint %% 20 = 0 THEN NULL ELSE (hashint %% 8000) / 100.0 END,
+                1 + (hashint %% 400) / 100.0,
+                5 + (hashint %% 4500) / 100.0,
+                (hashint %% 4000) / 100.0,
+                (ARRAY['Morning', 'Afternoon', 'Evening', 'Night'])[1 + hashint %% 4],
+                TO_CHAR(ts, 'FMDay'),
+                (hashint %% 50),
+                50 + (hashint %% 50),
+                (hashint %% 40000) / 100.0,
+                -5 + (hashint %% 400) / 10.0,
+                hashint %% 12,
+                (hashint / 11) %% %(clusters)s,
+                (hashint / 13) %% (%(clusters)s + 1) - 1,
+                ts
+            FROM (
+                SELECT
+                    g,
+                    ABS(HASHINT4(g)) as hashint,
+                    TIMESTAMP '2023-01-01' + g * INTERVAL '37 seconds' as ts
+                FROM generate_series(1, %(sessions)s) g
+            ) src
+        """, {"users": users, "sessions": sessions, "stations": stations, "clusters": clusters})
+        cursor.close()
+
+    with bench_connection() as conn:
+        if partitioned:
+            Partitions.convert_to_partitioned(conn)
+        StatsDB.refresh_daily_rollup(conn)
+        cursor = conn.cursor()
+        for table in BENCH_TABLES:
+            cursor.execute(f"ANALYZE {BENCH_SCHEMA}.{table}")
+        cursor.close()
+
+
+def drop_bench_data():
+    with DB.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        cursor.close()
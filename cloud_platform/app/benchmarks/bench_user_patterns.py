@@ -0,0 +1,194 @@
+"""
+Benchmark de get_user_behavior_patterns: versão antiga (3 queries + subquery
+correlacionada) contra a versão atual de passagem única.
+
+Gera dados sintéticos num schema isolado ("bench") e compara tempos e resultados.
+
+Uso (a partir de cloud_platform/app, com as variáveis DB_* definidas):
+    python -m benchmarks.bench_user_patterns --users 10000 --sessions 1000000
+"""
+import argparse
+import json
+import time
+
+from psycopg2.extras import RealDictCursor
+
+from utils import db as DB
+from utils import stats as StatsDB
+from benchmarks.bench_data import bench_connection, create_bench_data, drop_bench_data
+
+
+LEGACY_ENERGY_QUERY = """
+SELECT
+    user_id,
+    COUNT(*) as total_sessions,
+    SUM(energy_consumed_kwh) as total_energy_kwh,
+    COUNT(DISTINCT DATE_TRUNC('month', start_time)) as months_active,
+    CASE
+        WHEN COUNT(DISTINCT DATE_TRUNC('month', start_time)) > 0
+        THEN SUM(energy_consumed_kwh) / COUNT(DISTINCT DATE_TRUNC('month', start_time))
+        ELSE SUM(energy_consumed_kwh)
+    END as avg_monthly_energy_kwh,
+    MIN(start_time) as first_session,
+    MAX(start_time) as last_session
+FROM ev_session
+WHERE user_id IS NOT NULL
+  AND energy_consumed_kwh IS NOT NULL
+  AND start_time IS NOT NULL
+GROUP BY user_id
+ORDER BY avg_monthly_energy_kwh DESC;
+"""
+
+LEGACY_FREQUENCY_QUERY = """
+SELECT
+    user_id,
+    COUNT(*) as total_sessions,
+    COUNT(DISTINCT DATE(start_time)) as unique_days_used,
+    COUNT(DISTINCT DATE_TRUNC('month', start_time)) as months_active,
+    CASE
+        WHEN COUNT(DISTINCT DATE_TRUNC('month', start_time)) > 0
+        THEN COUNT(*)::FLOAT / COUNT(DISTINCT DATE_TRUNC('month', start_time))
+        ELSE COUNT(*)::FLOAT
+    END as sessions_per_month,
+    CASE
+        WHEN COUNT(DISTINCT DATE(start_time)) > 0
+        THEN COUNT(*)::FLOAT / COUNT(DISTINCT DATE(start_time))
+        ELSE 1
+    END as sessions_per_day_avg,
+    MIN(start_time) as first_session,
+    MAX(start_time) as last_session
+FROM ev_session
+WHERE user_id IS NOT NULL
+  AND start_time IS NOT NULL
+GROUP BY user_id
+ORDER BY sessions_per_month DESC;
+"""
+
+LEGACY_STATIONS_QUERY = """
+SELECT
+    user_id,
+    COUNT(*) as total_sessions,
+    COUNT(DISTINCT station_id) as unique_stations_used,
+    CASE
+        WHEN COUNT(*) > 0
+        THEN COUNT(DISTINCT station_id)::FLOAT / COUNT(*)
+        ELSE 0
+    END as station_variety_ratio,
+    ARRAY_AGG(DISTINCT station_id) as stations_list,
+    (SELECT station_id
+     FROM ev_session es2
+     WHERE es2.user_id = ev_session.user_id
+     GROUP BY station_id
+     ORDER BY COUNT(*) DESC
+     LIMIT 1) as preferred_station
+FROM ev_session
+WHERE user_id IS NOT NULL
+  AND station_id IS NOT NULL
+GROUP BY user_id
+ORDER BY unique_stations_used DESC, total_sessions DESC;
+"""
+
+
+def legacy_user_behavior_patterns(conn):
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute(LEGACY_ENERGY_QUERY)
+        energy_patterns = cursor.fetchall()
+        cursor.execute(LEGACY_FREQUENCY_QUERY)
+        frequency_patterns = cursor.fetchall()
+        cursor.execute(LEGACY_STATIONS_QUERY)
+        stations_patterns = cursor.fetchall()
+        return {
+            "energy_consumption": energy_patterns,
+            "usage_frequency": frequency_patterns,
+            "station_mobility": stations_patterns
+        }
+    finally:
+        cursor.close()
+
+
+def timed_run(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        with bench_connection() as conn:
+            start = time.perf_counter()
+            result = fn(conn)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _normalize(value):
+    # Somas em double precision dependem da ordem de agregação: compara com 6 casas decimais
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _by_user(rows):
+    return {
+        row["user_id"]: json.dumps(
+            {k: _normalize(v) for k, v in DB.make_json_safe(dict(row)).items()},
+            sort_keys=True
+        )
+        for row in rows
+    }
+
+
+def compare(legacy, current):
+    mismatches = {}
+    for section in ("energy_consumption", "usage_frequency", "station_mobility"):
+        old_rows = _by_user(legacy[section])
+        new_rows = _by_user(current[section])
+        ignore = {"preferred_station"} if section == "station_mobility" else set()
+        differing = 0
+        for user_id in old_rows.keys() | new_rows.keys():
+            old_row = json.loads(old_rows.get(user_id, "{}"))
+            new_row = json.loads(new_rows.get(user_id, "{}"))
+            for key in ignore:
+                old_row.pop(key, None)
+                new_row.pop(key, None)
+            if old_row != new_row:
+                differing += 1
+        mismatches[section] = differing
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark get_user_behavior_patterns")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--sessions", type=int, default=1000000)
+    parser.add_argument("--stations", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Keep the bench schema afterwards")
+    args = parser.parse_args()
+
+    print(f"Generating {args.sessions} sessions for {args.users} users / {args.stations} stations...", flush=True)
+    start = time.perf_counter()
+    create_bench_data(args.users, args.sessions, args.stations)
+    print(f"Data ready in {time.perf_counter() - start:.1f}s", flush=True)
+
+    try:
+        legacy_s, legacy = timed_run(legacy_user_behavior_patterns, args.repeat)
+        current_s, current = timed_run(StatsDB.get_user_behavior_patterns, args.repeat)
+        if "error" in current:
+            raise RuntimeError(current["error"])
+
+        print(f"Legacy (3 queries):  {legacy_s:.3f}s", flush=True)
+        print(f"Single scan:         {current_s:.3f}s", flush=True)
+        print(f"Speedup:             {legacy_s / current_s:.1f}x", flush=True)
+
+        # Empates na estação preferida não têm ordem definida na versão antiga
+        mismatches = compare(legacy, current)
+        print(f"Differing users per section: {mismatches}", flush=True)
+    finally:
+        if not args.keep:
+            drop_bench_data()
+        DB.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Verificação dos planos das queries de utils/stats.py sobre dados gerados.
+
+Cada função de stats corre contra o schema "bench" com uma ligação que faz
+EXPLAIN de cada query antes de a executar. Falha (exit 1) quando:
+  - uma query seletiva (ex.: refresh do resumo diário) faz Seq Scan em ev_session
+    (ou percorre um índice inteiro, sem condição na sua primeira coluna);
+  - as tendências voltam a ler ev_session em vez do resumo diário;
+  - qualquer query relê ev_session numa SubPlan correlacionada (uma vez por linha/grupo).
+
+Os agregados sobre a tabela toda podem fazer Seq Scan: ler tudo é o plano certo.
+
+Uso (a partir de cloud_platform/app, com as variáveis DB_* definidas):
+    python -m benchmarks.check_query_plans --sessions 200000
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import date
+
+from utils import db as DB
+from utils import stats as StatsDB
+from benchmarks.bench_data import bench_connection, create_bench_data, drop_bench_data
+
+SESSION_TABLE = "ev_session"
+
+# ev_session ou uma das suas partições mensais / default
+_SESSION_RELATION = re.compile(r"^ev_session(_\d{4}_\d{2}|_default)?$")
+
+_INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+class _ExplainingCursor:
+    def __init__(self, conn, cursor, plans):
+        self._conn = conn
+        self._cursor = cursor
+        self._plans = plans
+
+    def execute(self, query, params=None):
+        explain = self._conn.cursor()
+        try:
+            explain.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            self._plans.append((query, explain.fetchone()[0][0]["Plan"]))
+        finally:
+            explain.close()
+        return self._cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _ExplainingConnection:
+    """Regista o plano de cada query executada pelas funções de stats."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.plans = []
+
+    def cursor(self, *args, **kwargs):
+        return _ExplainingCursor(self._conn, self._conn.cursor(*args, **kwargs), self.plans)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _walk(node, in_subplan=False):
+    in_subplan = in_subplan or node.get("Parent Relationship") == "SubPlan"
+    yield node, in_subplan
+    for child in node.get("Plans", []):
+        yield from _walk(child, in_subplan)
+
+
+def plan_violations(plan, rules, leading_columns):
+    violations = []
+    for node, in_subplan in _walk(plan):
+        node_type = node["Node Type"]
+        index_name = node.get("Index Name")
+        reads_sessions = bool(_SESSION_RELATION.match(node.get("Relation Name", "")))
+        if not reads_sessions and index_name not in leading_columns:
+            continue
+        if "no_session_table" in rules:
+            violations.append(f"reads {SESSION_TABLE} ({node_type})")
+        # A partição default só guarda sessões sem mês próprio: pequena, um Seq Scan é o plano certo
+        if "no_seq_scan" in rules and node_type == "Seq Scan" and node.get("Relation Name") != "ev_session_default":
+            violations.append(f"Seq Scan on {SESSION_TABLE}")
+        if "no_seq_scan" in rules and node_type in _INDEX_SCANS:
+            # Um índice percorrido sem condição na primeira coluna é um Seq Scan disfarçado
+            leading = leading_columns.get(index_name)
+            if not re.search(rf"\b{leading}\b", node.get("Index Cond", "")):
+                violations.append(f"full {node_type} on {SESSION_TABLE} ({index_name})")
+        if in_subplan and reads_sessions:
+            violations.append(f"correlated SubPlan re-reads {SESSION_TABLE} ({node_type})")
+    return violations
+
+
+def _leading_columns(conn):
+    # Índice de ev_session ou das suas partições (no schema ativo) -> primeira coluna
+    # (pg_partition_tree não devolve nada para uma tabela não particionada)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT i.relname, a.attname
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0]
+            WHERE x.indrelid = %s::regclass
+               OR x.indrelid IN (SELECT relid FROM pg_partition_tree(%s::regclass));
+        """, (SESSION_TABLE, SESSION_TABLE))
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _sample_days(conn, count=3):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT day FROM ev_session_daily ORDER BY day DESC LIMIT %s;", (count,))
+        return [row[0] for row in cursor.fetchall()] or [date.today()]
+    finally:
+        cursor.close()
+
+
+# (nome, função(conn), regras) — todas as regras proíbem SubPlans correlacionadas sobre ev_session
+PLAN_CHECKS = [
+    ("refresh_daily_rollup(days)",
+     lambda conn: StatsDB.refresh_daily_rollup(conn, _sample_days(conn)), {"no_seq_scan"}),
+    ("get_daily_weekly_monthly_trends", StatsDB.get_daily_weekly_monthly_trends, {"no_session_table"}),
+    ("get_time_of_day_distribution", StatsDB.get_time_of_day_distribution, set()),
+    ("get_user_behavior_patterns", StatsDB.get_user_behavior_patterns, set()),
+    ("analyze_cluster_profiles", StatsDB.analyze_cluster_profiles, set()),
+    ("get_user_clusters", StatsDB.get_user_clusters, set()),
+]
+
+
+def run_checks(verbose=False):
+    failures = 0
+    for name, check, rules in PLAN_CHECKS:
+        with bench_connection() as conn:
+            leading_columns = _leading_columns(conn)
+            recorder = _ExplainingConnection(conn)
+            result = check(recorder)
+
+        problems = []
+        if isinstance(result, dict) and ("error" in result or result.get("success") is False):
+            problems.append(f"query failed: {result.get('error')}")
+        if not recorder.plans:
+            problems.append("no queries executed")
+        for query, plan in recorder.plans:
+            problems.extend(plan_violations(plan, rules, leading_columns))
+            if verbose:
+                print(json.dumps(plan, indent=2), flush=True)
+
+        status = "FAIL" if problems else "ok"
+        print(f"[{status}] {name} ({len(recorder.plans)} queries)", flush=True)
+        for problem in problems:
+            print(f"       - {problem}", flush=True)
+        failures += bool(problems)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check stats.py query plans for regressions")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=200000)
+    parser.add_argument("--stations", type=int, default=500)
+    parser.add_argument("--partitioned", action="store_true", help="Partition the bench ev_session by month")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    parser.add_argument("--keep", action="store_true", help="Keep the bench schema afterwards")
+    args = parser.parse_args()
+
+    create_bench_data(args.users, args.sessions, args.stations, partitioned=args.partitioned)
+    try:
+        failures = run_checks(args.verbose)
+    finally:
+        if not args.keep:
+            drop_bench_data()
+        DB.close_pool()
+
+    if failures:
+        print(f"{failures} stats function(s) with plan regressions", flush=True)
+        sys.exit(1)
+    print("All query plans ok", flush=True)
+
+
+if __name__ == "__main__":
+    main()
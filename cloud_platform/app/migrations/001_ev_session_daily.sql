@@ -0,0 +1,10 @@
+-- Resumo diário usado pelas tendências (bases criadas antes de existir em init.sql)
+CREATE TABLE IF NOT EXISTS ev_session_daily (
+    day DATE PRIMARY KEY,
+    session_count INTEGER NOT NULL,
+    energy_sum NUMERIC,
+    energy_count INTEGER NOT NULL,
+    duration_sum NUMERIC,
+    duration_count INTEGER NOT NULL,
+    cost_sum NUMERIC
+);
@@ -0,0 +1,13 @@
+-- Índices para as queries de stats e para a ingestão
+--
+-- start_time: refresh do resumo diário por intervalo de dia. B-tree e não BRIN,
+-- porque o dataset offline não é carregado por ordem cronológica.
+CREATE INDEX IF NOT EXISTS idx_ev_session_start_time ON ev_session(start_time);
+
+-- (user_id, start_time): padrões por user (agrupados por user_id, lidos por ordem)
+CREATE INDEX IF NOT EXISTS idx_ev_session_user_start ON ev_session(user_id, start_time);
+
+-- station_id: junção com ev_station e verificação da foreign key
+CREATE INDEX IF NOT EXISTS idx_ev_session_station ON ev_session(station_id);
+
+ANALYZE ev_session;
@@ -0,0 +1,18 @@
+-- Medições das sessões em double precision em vez de NUMERIC(12,8): agregados
+-- mais rápidos e valores lidos como float (sem Decimal). Reescreve a tabela uma vez.
+ALTER TABLE ev_session
+    ALTER COLUMN energy_consumed_kwh TYPE DOUBLE PRECISION,
+    ALTER COLUMN duration_h TYPE DOUBLE PRECISION,
+    ALTER COLUMN charging_rate_kw TYPE DOUBLE PRECISION,
+    ALTER COLUMN charging_cost_eur TYPE DOUBLE PRECISION,
+    ALTER COLUMN soc_start TYPE DOUBLE PRECISION,
+    ALTER COLUMN soc_end TYPE DOUBLE PRECISION,
+    ALTER COLUMN distance_driven_km TYPE DOUBLE PRECISION,
+    ALTER COLUMN temperature_c TYPE DOUBLE PRECISION;
+
+ALTER TABLE ev_session_daily
+    ALTER COLUMN energy_sum TYPE DOUBLE PRECISION,
+    ALTER COLUMN duration_sum TYPE DOUBLE PRECISION,
+    ALTER COLUMN cost_sum TYPE DOUBLE PRECISION;
+
+ANALYZE ev_session;
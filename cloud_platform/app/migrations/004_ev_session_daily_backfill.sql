@@ -0,0 +1,19 @@
+-- Preenche o resumo diário com os dias de ev_session que nunca lá chegaram: bases
+-- onde 001 criou a tabela vazia e os dados já existentes não são recarregados pelo
+-- bulk loader (OFFLINE_LOAD_MODE=rows só atualiza os dias das sessões que insere).
+-- Dias já presentes ficam como estão (mantidos pelo refresh incremental).
+INSERT INTO ev_session_daily (
+    day, session_count, energy_sum, energy_count, duration_sum, duration_count, cost_sum
+)
+SELECT
+    start_time::date,
+    COUNT(*),
+    SUM(energy_consumed_kwh),
+    COUNT(energy_consumed_kwh),
+    SUM(duration_h),
+    COUNT(duration_h),
+    SUM(charging_cost_eur)
+FROM ev_session
+WHERE start_time IS NOT NULL
+GROUP BY start_time::date
+ON CONFLICT (day) DO NOTHING;
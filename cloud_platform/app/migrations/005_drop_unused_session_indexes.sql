@@ -0,0 +1,9 @@
+-- Índices de 002 que nenhuma query usa (benchmarks/check_query_plans.py):
+--
+-- (user_id, start_time): os padrões por user leem a tabela toda; mesmo sem Seq Scan
+-- o planner prefere idx_ev_session_user_cluster. Só custava escrita na ingestão.
+DROP INDEX IF EXISTS idx_ev_session_user_start;
+
+-- station_id: a junção com ev_station é sobre a tabela toda (hash join) e as
+-- estações nunca são apagadas nem mudam de chave, por isso a foreign key não o usa.
+DROP INDEX IF EXISTS idx_ev_session_station;
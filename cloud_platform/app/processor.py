@@ -1,45 +1,381 @@
 import time
+import asyncio
 import utils.mqtt_subscriber as MQTTSub
 import utils.mqtt_publisher as MQTTPub
 import utils.db as DB
+import utils.ml_transport as MLTransport
+from utils.pipeline import Stage, StagedPipeline, run_blocking
+from utils.aggregates import DashboardAggregates
+from utils.scheduler import CoalescingScheduler
+from utils.stats_publisher import SectionedStatsPublisher
+from utils.stats_runner import StatsRunner
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import functools
 import json
 import csv
+import os
+import signal
+import aiohttp # type: ignore
 import requests
+from datetime import datetime, timedelta
 
 OFFLINE_DATA_FOLDER = "trainnning_dataset/"
 DATASET_EV_FILE = "dataset-EV_with_stations.csv"
 DATASET_STATIONS_FILE = "EV-Stations_with_ids_coords.csv"
 
+# "bulk" streams the CSV through COPY, "rows" keeps the original row-by-row inserts
+OFFLINE_LOAD_MODE = os.environ.get("OFFLINE_LOAD_MODE", "bulk")
+
+PREDICT_URL = "http://ml_processor:5000/predict_all_sessions"
+PARTIAL_FIT_URL = "http://ml_processor:5000/partial_fit"
+JOBS_URL = "http://ml_processor:5000/jobs/"
+
+# Full-table sessions go to ml_processor as msgpack columnar batches; "json" keeps the list-of-lists JSON body
+ML_TRANSPORT = os.environ.get("ML_TRANSPORT", "msgpack")
+
+# "db" lets ml_processor stream the training sessions from Postgres itself; "app" posts them like /predict
+ML_TRAIN_SOURCE = os.environ.get("ML_TRAIN_SOURCE", "db")
+ML_TRAIN_WINDOW_DAYS = int(os.environ.get("ML_TRAIN_WINDOW_DAYS", "0"))
+ML_TRAIN_SAMPLE_RATE = float(os.environ.get("ML_TRAIN_SAMPLE_RATE", "1"))
+# /train queues a background job; its status is polled this often
+ML_JOB_POLL_INTERVAL_S = float(os.environ.get("ML_JOB_POLL_INTERVAL_S", "2"))
+
+# Online sessions are also folded into the session clustering (incremental update, no full retrain)
+ML_ONLINE_UPDATES = os.environ.get("ML_ONLINE_UPDATES", "1") == "1"
+
+# Online messages are flushed once this many are queued or the oldest has waited this long
+ONLINE_BATCH_SIZE = int(os.environ.get("ONLINE_BATCH_SIZE", "50"))
+ONLINE_BATCH_LINGER_MS = int(os.environ.get("ONLINE_BATCH_LINGER_MS", "200"))
+
+# Online messages run through receive -> persist -> predict -> write-back -> publish stages joined by bounded
+# queues; the MQTT loop only queues raw payloads and drops them (counted) if the receive queue is full
+PIPELINE_RECEIVE_QUEUE_SIZE = int(os.environ.get("PIPELINE_RECEIVE_QUEUE_SIZE", "10000"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "100"))
+PIPELINE_PERSIST_CONCURRENCY = int(os.environ.get("PIPELINE_PERSIST_CONCURRENCY", "2"))
+PIPELINE_PREDICT_CONCURRENCY = int(os.environ.get("PIPELINE_PREDICT_CONCURRENCY", "4"))
+PIPELINE_WRITEBACK_CONCURRENCY = int(os.environ.get("PIPELINE_WRITEBACK_CONCURRENCY", "2"))
+PIPELINE_STATUS_INTERVAL_S = float(os.environ.get("PIPELINE_STATUS_INTERVAL_S", "5"))
+PIPELINE_STATUS_TOPIC = "dataset/ev/pipeline"
+ML_HTTP_TIMEOUT_S = float(os.environ.get("ML_HTTP_TIMEOUT_S", "30"))
+
+# Online batches publish from running aggregates; the SQL stats are re-run this often as a consistency check
+DASHBOARD_FULL_RECOMPUTE_S = float(os.environ.get("DASHBOARD_FULL_RECOMPUTE_S", "600"))
+
+# Dashboard publishes are coalesced: at most one per interval, debounced, but never staler than the max
+DASHBOARD_PUBLISH_INTERVAL_S = float(os.environ.get("DASHBOARD_PUBLISH_INTERVAL_S", "2"))
+DASHBOARD_PUBLISH_DEBOUNCE_S = float(os.environ.get("DASHBOARD_PUBLISH_DEBOUNCE_S", "0.5"))
+DASHBOARD_PUBLISH_MAX_STALENESS_S = float(os.environ.get("DASHBOARD_PUBLISH_MAX_STALENESS_S", "10"))
+
+# Each stats section goes to dataset/ev/stats/<section>; maps listed here are sent as deltas
+STATS_DELTA_SECTIONS = [s for s in os.environ.get("STATS_DELTA_SECTIONS", "userClusters").split(",") if s]
+STATS_SNAPSHOT_EVERY = int(os.environ.get("STATS_SNAPSHOT_EVERY", "50"))
+STATS_PUBLISH_COMBINED = os.environ.get("STATS_PUBLISH_COMBINED", "0") == "1"
+
+# "monthly" converts ev_session into monthly range partitions on start_time and keeps them maintained
+EV_SESSION_PARTITIONING = os.environ.get("EV_SESSION_PARTITIONING", "none")
+PARTITION_MAINTENANCE_INTERVAL_S = float(os.environ.get("PARTITION_MAINTENANCE_INTERVAL_S", "86400"))
+
+# Full stats refreshes run their queries in parallel on pooled connections
+STATS_WORKERS = int(os.environ.get("STATS_WORKERS", "5"))
+STATS_QUERY_TIMEOUT_S = float(os.environ.get("STATS_QUERY_TIMEOUT_S", "30"))
+
+stats_runner = StatsRunner(max_workers=STATS_WORKERS, timeout_s=STATS_QUERY_TIMEOUT_S)
+
+dashboard_aggregates = DashboardAggregates()
+last_full_recompute = {"at": 0.0}
+# Sessions inserted by the online pipeline / folded into the aggregates (one writer thread each); the gap
+# is what a full recompute can count that the aggregates don't have yet, or the other way round
+online_sessions = {"persisted": 0, "applied": 0}
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_dashboard_publisher():
+    # One long-lived broker connection for every dashboard publish
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            mqtt_pub = MQTTPub.MqttPublisher()
+            mqtt_pub.connect()
+            _publisher = SectionedStatsPublisher(
+                mqtt_pub,
+                delta_sections=STATS_DELTA_SECTIONS,
+                snapshot_every=STATS_SNAPSHOT_EVERY,
+                publish_combined=STATS_PUBLISH_COMBINED
+            )
+        return _publisher
+
+
+def publish_dashboard_stats(totalStats):
+    changed = get_dashboard_publisher().publish(totalStats)
+    print(f"Dashboard sections published: {', '.join(changed) or 'none changed'}", flush=True)
+
+
+def compute_dashboard_stats():
+    # Sections whose query failed are missing, so their last retained publish stays in place
+    totalStats, _ = stats_runner.run()
+    return totalStats
+
+
+def _dashboard_drift(sql_stats, agg_stats, tolerance=0):
+    # `tolerance`: online sessions that may be counted on one side only (committed, not yet in the aggregates)
+    def pick(stats, *path):
+        for key in path:
+            if not isinstance(stats, dict):
+                return None
+            stats = stats.get(key)
+        return stats
+
+    def differs(a, b):
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return abs(a - b) > tolerance
+        return a != b
+
+    checks = [
+        ("trendsStats", "summary", "total_sessions"),
+        ("userPatterns", "summary", "total_users"),
+        ("userPatterns", "summary", "total_sessions"),
+        ("clusterProfiles", "summary", "total_sessions_analyzed"),
+    ]
+    drift = [
+        "/".join(path) for path in checks
+        if path[0] in sql_stats and differs(pick(sql_stats, *path), pick(agg_stats, *path))
+    ]
+    if "todDistribution" in sql_stats:
+        sql_tod = {r["time_of_day"]: r["session_count"] for r in sql_stats["todDistribution"]}
+        agg_tod = {r["time_of_day"]: r["session_count"] for r in agg_stats["todDistribution"]}
+        if sum(abs(sql_tod.get(t, 0) - agg_tod.get(t, 0)) for t in sql_tod.keys() | agg_tod.keys()) > tolerance:
+            drift.append("todDistribution")
+    if sql_stats.get("userClusters") is not None and differs(len(sql_stats["userClusters"]), len(agg_stats["userClusters"])):
+        drift.append("userClusters")
+    return drift
+
 
 def update_dashboard_stats():
+    # Full recompute over ev_session; also re-syncs the running aggregates if they drifted
     print("Updating dashboard stats...", flush=True)
-    mqtt_pub = MQTTPub.MqttPublisher()
-    mqtt_pub.connect()
+    applied_before = online_sessions["applied"]
+    totalStats = compute_dashboard_stats()
+    agg_stats = dashboard_aggregates.snapshot()
 
-    trendsStats = DB.get_daily_weekly_monthly_trends()
-    trendsStats = DB.make_json_safe(trendsStats)
+    # Batches persisted but not yet applied when the SQL ran, plus any persisted while it ran
+    in_flight = online_sessions["persisted"] - applied_before
+    drift = _dashboard_drift(totalStats, agg_stats, tolerance=in_flight)
+    if drift:
+        print(f"Dashboard aggregates drifted ({', '.join(drift)}), rebuilding", flush=True)
+        dashboard_aggregates.rebuild(DB.iter_dashboard_sessions(), DB.get_archived_rollup_days())
 
-    todDistribution = DB.get_time_of_day_distribution()
-    todDistribution = DB.make_json_safe(todDistribution)
+    last_full_recompute["at"] = time.monotonic()
+    publish_dashboard_stats(totalStats)
+    print("Dashboard stats updated!", flush=True)
 
-    userPatterns = DB.get_user_behavior_patterns()
-    userPatterns = DB.make_json_safe(userPatterns)
 
-    cluster_profiles = DB.get_cluster_profiles()
-    cluster_profiles = DB.make_json_safe(cluster_profiles)
+def publish_dashboard_from_aggregates():
+    if time.monotonic() - last_full_recompute["at"] >= DASHBOARD_FULL_RECOMPUTE_S:
+        update_dashboard_stats()
+        return
 
-    userClusters = DB.get_user_clusters()
-    userClusters = DB.make_json_safe(userClusters)
+    publish_dashboard_stats(dashboard_aggregates.snapshot())
+    print("Dashboard stats updated from running aggregates!", flush=True)
+
+
+dashboard_scheduler = CoalescingScheduler(
+    publish_dashboard_from_aggregates,
+    min_interval_s=DASHBOARD_PUBLISH_INTERVAL_S,
+    debounce_s=DASHBOARD_PUBLISH_DEBOUNCE_S,
+    max_staleness_s=DASHBOARD_PUBLISH_MAX_STALENESS_S,
+    name="dashboard-publisher"
+)
+
+
+_persist_executor = ThreadPoolExecutor(max_workers=PIPELINE_PERSIST_CONCURRENCY, thread_name_prefix="pipeline-persist")
+_writeback_executor = ThreadPoolExecutor(max_workers=PIPELINE_WRITEBACK_CONCURRENCY, thread_name_prefix="pipeline-writeback")
+_publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-publish")
+_http_session = None
+
+
+def get_http_session():
+    # Created lazily so it belongs to the pipeline's event loop
+    global _http_session
+    if _http_session is None:
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=ML_HTTP_TIMEOUT_S))
+    return _http_session
+
+
+async def receive_messages(station_map, payloads):
+    batch = []
+    for payload in payloads:
+        try:
+            rowjson = json.loads(payload.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print("Invalid JSON data received", flush=True)
+            continue
+
+        station_id = rowjson.get("Charging Station ID")
+        station_row = station_map.get(station_id)
+        if not station_row:
+            print(f"Unknown station {station_id}, session ignored", flush=True)
+            continue
+
+        batch.append((rowjson, station_row))
+    return batch or None
+
+
+async def persist_batch(batch):
+    session_rows = [rowjson for rowjson, _ in batch]
+    station_rows = [station_row for _, station_row in batch]
+
+    districts = {r.get("\ufeffStation ID"): r.get("Distrito") for r in station_rows}
+
+    inserted_rows = await run_blocking(_persist_executor, DB.insert_online_batch, session_rows, station_rows)
+    print(f"Batch of {len(batch)} messages: {len(inserted_rows)} new sessions", flush=True)
+    if not inserted_rows:
+        return None
+    online_sessions["persisted"] += len(inserted_rows)
+    return {"rows": inserted_rows, "districts": districts, "predictions": {}}
 
-    totalStats = {
-        "trendsStats": trendsStats,
-        "todDistribution": todDistribution,
-        "userPatterns": userPatterns,
-        "clusterProfiles": cluster_profiles,
-        "userClusters": userClusters
-    }
-    mqtt_pub.publish(json.dumps(totalStats))
-    print("Dashboard stats updated!", flush=True)
+
+async def predict_batch(batch):
+    # From here on a stored batch always reaches publish (without clusters if a step fails), so every
+    # persisted session is eventually applied to the aggregates
+    try:
+        await _predict_batch(batch)
+    except Exception as e:
+        print(f"Erro: {e}", flush=True)
+    return batch
+
+
+async def _predict_batch(batch):
+    ev_sessions = DB.make_json_safe(batch["rows"])
+
+    payload = {"ev_sessions": ev_sessions}
+    async with get_http_session().get(PREDICT_URL, json=payload) as response:
+        status_code = response.status
+        result = await response.json()
+
+    if status_code == 200:
+        status = result["status"]
+        predictions = result["results"]
+        batch["predictions"] = predictions
+        print(f" Status: {status} |", end="", flush=True)
+        print(f" Predicted: {len(predictions)} sessions", flush=True)
+        for ev_session in ev_sessions:
+            prediction = predictions.get(str(ev_session[0]), {})
+            print(f"  Session {ev_session[0]} ({ev_session[1]} @ {ev_session[4]}): {prediction}", flush=True)
+        if ML_ONLINE_UPDATES:
+            await send_online_update(payload)
+    else:
+        error = result["error"]
+        print(f"Erro: {error}")
+
+
+async def write_back_batch(batch):
+    if batch["predictions"]:
+        try:
+            await run_blocking(_writeback_executor, DB.update_cluster_predictions, batch["predictions"])
+        except Exception as e:
+            print(f"Cluster write-back failed: {e}", flush=True)
+    return batch
+
+
+def add_online_sessions(batch):
+    predictions = batch["predictions"]
+    try:
+        for row in batch["rows"]:
+            session = dict(zip(DB.EV_SESSION_COLUMNS, row))
+            session["cluster_kmeans"] = predictions.get(str(session["id"]), {}).get("cluster_kmeans")
+            session["distrito"] = batch["districts"].get(session["station_id"])
+            dashboard_aggregates.add_session(session)
+    finally:
+        online_sessions["applied"] += len(batch["rows"])
+    dashboard_scheduler.trigger()
+
+
+async def publish_batch(batch):
+    # The aggregates lock is shared with the dashboard scheduler thread: taken off the loop
+    await run_blocking(_publish_executor, add_online_sessions, batch)
+    print("Online EV dataset sent to DB!", flush=True)
+
+
+async def send_online_update(payload):
+    try:
+        async with get_http_session().post(PARTIAL_FIT_URL, json=payload) as response:
+            if response.status != 200:
+                result = await response.json()
+                print(f"Erro: {result.get('error')}", flush=True)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Erro: {e}", flush=True)
+
+
+def publish_pipeline_status(status):
+    # paho only queues the message, so this is safe to call from the pipeline loop
+    get_dashboard_publisher().mqtt_pub.publish(json.dumps(status), topic=PIPELINE_STATUS_TOPIC, retain=True)
+
+
+def build_online_pipeline(station_map):
+    return StagedPipeline(
+        [
+            Stage("receive", functools.partial(receive_messages, station_map),
+                  queue_size=PIPELINE_RECEIVE_QUEUE_SIZE, batch_size=ONLINE_BATCH_SIZE, linger_ms=ONLINE_BATCH_LINGER_MS),
+            Stage("persist", persist_batch, concurrency=PIPELINE_PERSIST_CONCURRENCY, queue_size=PIPELINE_QUEUE_SIZE),
+            Stage("predict", predict_batch, concurrency=PIPELINE_PREDICT_CONCURRENCY, queue_size=PIPELINE_QUEUE_SIZE),
+            Stage("write_back", write_back_batch, concurrency=PIPELINE_WRITEBACK_CONCURRENCY, queue_size=PIPELINE_QUEUE_SIZE),
+            Stage("publish", publish_batch, queue_size=PIPELINE_QUEUE_SIZE),
+        ],
+        on_status=publish_pipeline_status,
+        status_interval_s=PIPELINE_STATUS_INTERVAL_S,
+        name="online-pipeline"
+    )
+
+
+def send_all_sessions(method, url):
+    if ML_TRANSPORT == "msgpack":
+        columns, count = DB.get_all_ev_sessions_columnar()
+        return MLTransport.send_sessions(method, url, columns, count)
+    payload = {"ev_sessions": DB.get_all_ev_sessions()}
+    response = requests.request(method, url, json=payload)
+    return response.status_code, response.json()
+
+
+def request_db_training(url):
+    query = {"sample_rate": ML_TRAIN_SAMPLE_RATE}
+    if ML_TRAIN_WINDOW_DAYS > 0:
+        query["start"] = (datetime.now() - timedelta(days=ML_TRAIN_WINDOW_DAYS)).isoformat()
+    response = requests.post(url, json={"query": query})
+    return response.status_code, response.json()
+
+
+def wait_for_training_job(job_id):
+    while True:
+        response = requests.get(JOBS_URL + job_id)
+        job = response.json()
+        if response.status_code != 200:
+            return response.status_code, job
+        if job["status"] == "succeeded":
+            return 200, job
+        if job["status"] == "failed":
+            return 500, job
+        time.sleep(ML_JOB_POLL_INTERVAL_S)
+
+
+def shutdown():
+    # The last pending dashboard publish is flushed before the broker connection closes
+    dashboard_scheduler.stop(timeout=DASHBOARD_PUBLISH_MAX_STALENESS_S)
+    stats_runner.shutdown()
+    if _publisher is not None:
+        _publisher.mqtt_pub.disconnect()
+    print("Processor stopped", flush=True)
+
+
+def run_partition_maintenance():
+    while True:
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL_S)
+        try:
+            DB.maintain_partitions()
+        except Exception as e:
+            print(f"Partition maintenance failed: {e}", flush=True)
 
 
 def main():
@@ -51,28 +387,41 @@ def main():
         for row in reader:
             station_map[row["\ufeffStation ID"]] = row
 
+    DB.run_migrations()
+    if EV_SESSION_PARTITIONING == "monthly":
+        DB.enable_partitioning()
+
     print("Inserting EV sessions into the database...", flush=True)
-    with open(OFFLINE_DATA_FOLDER + DATASET_EV_FILE, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=";")
-        for row in reader:
-            station_id = row["Charging Station ID"]
-            station_row = station_map.get(station_id)
-            if station_row:
-                DB.insert_station_data(json.dumps(station_row))
-                DB.insert_ev_data(json.dumps(row))
+    if OFFLINE_LOAD_MODE == "bulk":
+        DB.bulk_load_offline_dataset(OFFLINE_DATA_FOLDER + DATASET_EV_FILE, station_map)
+    else:
+        with open(OFFLINE_DATA_FOLDER + DATASET_EV_FILE, newline="", encoding="utf-8") as csvfile:
+            reader = csv.DictReader(csvfile, delimiter=";")
+            for row in reader:
+                station_id = row["Charging Station ID"]
+                station_row = station_map.get(station_id)
+                if station_row:
+                    DB.insert_station_data(json.dumps(station_row))
+                    DB.insert_ev_data(json.dumps(row))
 
     print("Offline dataset loaded to database!", flush=True)
 
+    if EV_SESSION_PARTITIONING == "monthly":
+        DB.maintain_partitions()
+        threading.Thread(target=run_partition_maintenance, name="partition-maintenance", daemon=True).start()
+
 
     # ML Processing
     print("Trainning ML models...", flush=True)
     url = "http://ml_processor:5000/train"
-    ev_sessions_data = DB.get_all_ev_sessions()
-    ev_sessions_data = DB.make_json_safe(ev_sessions_data)
-    payload = {"ev_sessions": ev_sessions_data}
-    response = requests.post(url, json=payload)
-    result = response.json()
-    if response.status_code == 200:
+    if ML_TRAIN_SOURCE == "db":
+        status_code, result = request_db_training(url)
+    else:
+        status_code, result = send_all_sessions("POST", url)
+    if status_code == 202:
+        print(f"Training job {result['job_id']} queued", flush=True)
+        status_code, result = wait_for_training_job(result["job_id"])
+    if status_code == 200:
         status = result["status"]
         meta = result["meta"]
         print("ML Models Trained |", end="", flush=True)
@@ -85,13 +434,9 @@ def main():
     
     # Predictions for Offline Data
     print("Predicting Sessions...", flush=True)
-    url = "http://ml_processor:5000/predict_all_sessions"
-    ev_sessions_data = DB.get_all_ev_sessions()
-    ev_sessions_data = DB.make_json_safe(ev_sessions_data)
-    payload = {"ev_sessions": ev_sessions_data}
-    response = requests.get(url, json=payload)
-    result = response.json()
-    if response.status_code == 200:
+    url = PREDICT_URL
+    status_code, result = send_all_sessions("GET", url)
+    if status_code == 200:
         print("Sessions Predicted!", flush=True)
         predictions = result["results"]
         DB.update_cluster_predictions(predictions)
@@ -101,11 +446,15 @@ def main():
 
 
     # Update Dashboard Stats
+    dashboard_aggregates.rebuild(DB.iter_dashboard_sessions(), DB.get_archived_rollup_days())
     update_dashboard_stats()
 
 
     # Online Data Processing
-    url = "http://ml_processor:5000//predict_all_sessions"
+    dashboard_scheduler.start()
+    pipeline = build_online_pipeline(station_map)
+    pipeline.start()
+
     mqqt_sub = MQTTSub.MqttSubscriber()
     mqqt_sub.connect()
 
@@ -115,42 +464,15 @@ def main():
     print("#############################", flush=True)
 
     def on_message(client, userdata, msg):
-        row = msg.payload.decode()
-        rowjson = json.loads(row)
-        station_id = rowjson.get("Charging Station ID")
-        station_row = station_map[station_id]
-        if station_row:
-            DB.insert_station_data(json.dumps(station_row))
-            DB.insert_ev_data(row)
-
-        ev_session = DB.get_last_inserted_session()
-        ev_session = DB.make_json_safe(ev_session)
-        ev_session = [ev_session]
-
-        payload = {"ev_sessions": ev_session}
-        response = requests.get(url, json=payload)
-        result = response.json()
-        
-        if response.status_code == 200:
-            status = result["status"]
-            predictions = result["results"]
-            DB.update_cluster_predictions(predictions)
-            print(f" Status: {status} |", end="", flush=True)
-            print(f" Result: {meta}", flush=True)
-            ev_session = DB.get_last_inserted_session()
-            ev_session = DB.make_json_safe(ev_session)
-            print(ev_session, flush=True)
-        else:
-            error = result["error"]
-            print(f"Erro: {error}")
-        
-        update_dashboard_stats()
-        print("Online EV dataset sent to DB!", flush=True)
-        
+        # Never blocks: parsing, DB and ML calls all happen in the pipeline stages
+        pipeline.submit(msg.payload)
 
     mqqt_sub.client.on_message = on_message
 
+    # docker stop sends SIGTERM: handled like Ctrl+C, so the subscriber loop returns and shutdown() runs
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     mqqt_sub.start()
+    shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,461 @@
+from collections import Counter, defaultdict
+from array import array
+import threading
+
+# Same ordering as the CASE in stats.get_time_of_day_distribution
+TIME_OF_DAY_ORDER = {"morning": 1, "afternoon": 2, "evening": 3, "night": 4}
+
+# Ids this far below the highest one a rebuild read are checked one by one: a batch still uncommitted
+# during the rebuild can hold lower ids than rows it already saw (concurrent online inserts)
+REBUILD_ID_WINDOW = 10000
+
+# Attributes set by DashboardAggregates._reset(), swapped in as a whole by rebuild()
+_STATE_FIELDS = ("total_sessions", "daily", "weekly", "monthly", "time_of_day", "users", "clusters")
+
+
+def _num(value):
+    return None if value is None else float(value)
+
+
+def _round(value, digits):
+    return None if value is None else round(value, digits)
+
+
+def _mode(counter):
+    # Ties are broken by the smallest value, like MODE() WITHIN GROUP (ORDER BY ...)
+    if not counter:
+        return None
+    best = max(counter.values())
+    return min(k for k, v in counter.items() if v == best)
+
+
+class _Mean:
+    __slots__ = ("total", "n")
+
+    def __init__(self):
+        self.total = 0.0
+        self.n = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+            self.n += 1
+
+    def add_total(self, total, n):
+        if total is not None and n:
+            self.total += total
+            self.n += n
+
+    @property
+    def sum(self):
+        return self.total if self.n else None
+
+    @property
+    def avg(self):
+        return self.total / self.n if self.n else None
+
+
+class _Trend:
+    __slots__ = ("count", "energy", "duration", "cost")
+
+    def __init__(self):
+        self.count = 0
+        self.energy = _Mean()
+        self.duration = _Mean()
+        self.cost = _Mean()
+
+    def add(self, s):
+        self.count += 1
+        self.energy.add(s["energy_consumed_kwh"])
+        self.duration.add(s["duration_h"])
+        self.cost.add(s["charging_cost_eur"])
+
+    def add_rollup(self, day):
+        # A pre-aggregated ev_session_daily row (cost has no count there; only its sum is rendered)
+        self.count += day["session_count"]
+        self.energy.add_total(day["energy_sum"], day["energy_count"])
+        self.duration.add_total(day["duration_sum"], day["duration_count"])
+        self.cost.add_total(day["cost_sum"], day["session_count"])
+
+    def as_dict(self, **key):
+        return {
+            **key,
+            "session_count": self.count,
+            "total_energy": self.energy.sum,
+            "avg_energy": self.energy.avg,
+            "avg_duration": self.duration.avg,
+            "total_cost": self.cost.sum
+        }
+
+
+class _UserStats:
+    __slots__ = (
+        "e_sessions", "e_total", "e_months", "e_first", "e_last",
+        "f_sessions", "f_days", "f_months", "f_first", "f_last",
+        "s_sessions", "stations", "clusters"
+    )
+
+    def __init__(self):
+        self.e_sessions = 0
+        self.e_total = 0.0
+        self.e_months = set()
+        self.e_first = self.e_last = None
+        self.f_sessions = 0
+        self.f_days = set()
+        self.f_months = set()
+        self.f_first = self.f_last = None
+        self.s_sessions = 0
+        self.stations = Counter()
+        self.clusters = Counter()
+
+
+class _ClusterStats:
+    __slots__ = (
+        "count", "energy", "cost", "duration", "rate", "battery", "age", "distance",
+        "soc_start", "soc_end", "temperature", "start_hour",
+        "times", "days", "stations", "districts", "models", "users"
+    )
+
+    def __init__(self):
+        self.count = 0
+        for name in ("energy", "cost", "duration", "rate", "battery", "age", "distance",
+                     "soc_start", "soc_end", "temperature", "start_hour"):
+            setattr(self, name, _Mean())
+        for name in ("times", "days", "stations", "districts", "models", "users"):
+            setattr(self, name, Counter())
+
+
+def _gt(value, limit):
+    # NULL comparisons are false in the SQL CASE this mirrors
+    return value is not None and value > limit
+
+
+def _session_profile(c):
+    most_common_time = _mode(c.times)
+    avg_duration = c.duration.avg
+    if avg_duration is not None and avg_duration < 2 and most_common_time in ("Morning", "Afternoon"):
+        return "Quick Day Chargers"
+    if _gt(c.energy.avg, 40) and _gt(avg_duration, 3):
+        return "Long Session Users"
+    if most_common_time == "Night":
+        return "Overnight Chargers"
+    if _gt(c.rate.avg, 10):
+        return "Fast Charging Sessions"
+    if len(c.stations) > 5:
+        return "Multi-Station Users"
+    return "Standard Usage"
+
+
+def _min(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+
+def _max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+class DashboardAggregates:
+    """
+    Running per-day/week/month, per time_of_day, per user and per cluster aggregates of ev_session.
+    add_session() is O(1); snapshot() renders the same sections as the SQL queries in stats.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        # add_session() skips sessions a rebuild already counted (ids up to rebuilt_max_id, minus the unseen ones)
+        self.rebuilt_max_id = None
+        self._unseen_ids = set()
+        # Sessions added while a rebuild reads the table, replayed onto the rebuilt state
+        self._added_during_rebuild = None
+
+    def _reset(self):
+        self.total_sessions = 0
+        self.daily = defaultdict(_Trend)
+        self.weekly = defaultdict(_Trend)
+        self.monthly = defaultdict(_Trend)
+        self.time_of_day = Counter()
+        self.users = defaultdict(_UserStats)
+        self.clusters = defaultdict(_ClusterStats)
+
+    def rebuild(self, sessions, archived_days=()):
+        """
+        `archived_days`: ev_session_daily rows of days no longer in ev_session (detached partitions),
+        counted in the trends like the SQL version, which reads the rollup.
+        """
+        # The table is read into a separate instance without holding the lock, so add_session() and
+        # snapshot() keep answering from the current state; the lock is only taken to swap it in
+        with self._lock:
+            self._added_during_rebuild = []
+
+        fresh = DashboardAggregates()
+        ids = array("q")
+        try:
+            for day in archived_days:
+                fresh._add_archived_day(day)
+            for session in sessions:
+                fresh._add(session)
+                if session.get("id") is not None:
+                    ids.append(session["id"])
+        except BaseException:
+            # The current state stays in place and keeps every session added meanwhile
+            with self._lock:
+                self._added_during_rebuild = None
+            raise
+
+        rebuilt_max_id = max(ids) if ids else None
+        unseen_ids = set()
+        if ids:
+            low = rebuilt_max_id - REBUILD_ID_WINDOW
+            unseen_ids = set(range(low + 1, rebuilt_max_id)).difference(i for i in ids if i > low)
+
+        with self._lock:
+            for name in _STATE_FIELDS:
+                setattr(self, name, getattr(fresh, name))
+            self.rebuilt_max_id = rebuilt_max_id
+            self._unseen_ids = unseen_ids
+            added, self._added_during_rebuild = self._added_during_rebuild, None
+            for session in added:
+                self._add_new(session)
+
+    def add_session(self, session):
+        with self._lock:
+            if self._added_during_rebuild is not None:
+                self._added_during_rebuild.append(session)
+            self._add_new(session)
+
+    def _add_new(self, session):
+        session_id = session.get("id")
+        if self.rebuilt_max_id is not None and session_id is not None and session_id <= self.rebuilt_max_id:
+            # Committed before the rebuild read the table, so it is already counted
+            if session_id not in self._unseen_ids:
+                return
+            self._unseen_ids.discard(session_id)
+        self._add(session)
+
+    def _add_archived_day(self, row):
+        day = row["day"]
+        self.daily[day].add_rollup(row)
+        self.weekly[(day.year, day.isocalendar()[1])].add_rollup(row)
+        self.monthly[(day.year, day.month)].add_rollup(row)
+
+    def _add(self, raw):
+        s = dict(raw)
+        for key in ("energy_consumed_kwh", "duration_h", "charging_cost_eur", "charging_rate_kw",
+                    "soc_start", "soc_end", "battery_capacity_kwh", "vehicle_age_years",
+                    "distance_driven_km", "temperature_c"):
+            s[key] = _num(s.get(key))
+
+        self.total_sessions += 1
+        start = s.get("start_time")
+        user_id = s.get("user_id")
+        station_id = s.get("station_id")
+        energy = s["energy_consumed_kwh"]
+
+        if start is not None:
+            day = start.date()
+            self.daily[day].add(s)
+            self.weekly[(start.year, start.isocalendar()[1])].add(s)
+            self.monthly[(start.year, start.month)].add(s)
+
+        if s.get("time_of_day") is not None:
+            self.time_of_day[s["time_of_day"]] += 1
+
+        if user_id is not None:
+            u = self.users[user_id]
+            if start is not None:
+                month = (start.year, start.month)
+                if energy is not None:
+                    u.e_sessions += 1
+                    u.e_total += energy
+                    u.e_months.add(month)
+                    u.e_first = _min(u.e_first, start)
+                    u.e_last = _max(u.e_last, start)
+                u.f_sessions += 1
+                u.f_days.add(start.date())
+                u.f_months.add(month)
+                u.f_first = _min(u.f_first, start)
+                u.f_last = _max(u.f_last, start)
+            if station_id is not None:
+                u.s_sessions += 1
+                u.stations[station_id] += 1
+
+        cluster = s.get("cluster_kmeans")
+        if cluster is not None:
+            if user_id is not None:
+                self.users[user_id].clusters[cluster] += 1
+
+            c = self.clusters[cluster]
+            c.count += 1
+            c.energy.add(energy)
+            c.cost.add(s["charging_cost_eur"])
+            c.duration.add(s["duration_h"])
+            c.rate.add(s["charging_rate_kw"])
+            c.battery.add(s["battery_capacity_kwh"])
+            c.age.add(s["vehicle_age_years"])
+            c.distance.add(s["distance_driven_km"])
+            c.soc_start.add(s["soc_start"])
+            c.soc_end.add(s["soc_end"])
+            c.temperature.add(s["temperature_c"])
+            c.start_hour.add(float(start.hour) if start is not None else None)
+            for counter, key in ((c.times, "time_of_day"), (c.days, "day_of_week"),
+                                 (c.stations, "station_id"), (c.districts, "distrito"),
+                                 (c.models, "vehicle_model"), (c.users, "user_id")):
+                if s.get(key) is not None:
+                    counter[s[key]] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "trendsStats": self._trends(),
+                "todDistribution": self._time_of_day(),
+                "userPatterns": self._user_patterns(),
+                "clusterProfiles": self._cluster_profiles(),
+                "userClusters": self._user_clusters()
+            }
+
+    def _trends(self):
+        daily = [self.daily[k].as_dict(date=k.isoformat()) for k in sorted(self.daily)]
+        # EXTRACT() in the SQL version yields year/week/month as floats; same types keep the section hashes equal
+        weekly = [self.weekly[k].as_dict(year=float(k[0]), week=float(k[1])) for k in sorted(self.weekly)]
+        monthly = [self.monthly[k].as_dict(year=float(k[0]), month=float(k[1])) for k in sorted(self.monthly)]
+        return {
+            "daily_trends": daily,
+            "weekly_trends": weekly,
+            "monthly_trends": monthly,
+            "summary": {
+                "total_sessions": sum(d["session_count"] for d in daily),
+                "total_energy": sum(d["total_energy"] or 0 for d in daily),
+                "total_cost": sum(d["total_cost"] or 0 for d in daily)
+            }
+        }
+
+    def _time_of_day(self):
+        order = sorted(self.time_of_day, key=lambda t: (TIME_OF_DAY_ORDER.get(t, 5), t))
+        return [{"time_of_day": t, "session_count": self.time_of_day[t]} for t in order]
+
+    def _user_patterns(self):
+        energy, frequency, stations = [], [], []
+        for user_id, u in self.users.items():
+            if u.e_sessions:
+                months = len(u.e_months)
+                energy.append({
+                    "user_id": user_id,
+                    "total_sessions": u.e_sessions,
+                    "total_energy_kwh": u.e_total,
+                    "months_active": months,
+                    "avg_monthly_energy_kwh": u.e_total / months,
+                    "first_session": u.e_first.isoformat(),
+                    "last_session": u.e_last.isoformat()
+                })
+            if u.f_sessions:
+                months = len(u.f_months)
+                days = len(u.f_days)
+                frequency.append({
+                    "user_id": user_id,
+                    "total_sessions": u.f_sessions,
+                    "unique_days_used": days,
+                    "months_active": months,
+                    "sessions_per_month": u.f_sessions / months,
+                    "sessions_per_day_avg": u.f_sessions / days,
+                    "first_session": u.f_first.isoformat(),
+                    "last_session": u.f_last.isoformat()
+                })
+            if u.s_sessions:
+                station_list = sorted(u.stations)
+                stations.append({
+                    "user_id": user_id,
+                    "total_sessions": u.s_sessions,
+                    "unique_stations_used": len(station_list),
+                    "station_variety_ratio": len(station_list) / u.s_sessions,
+                    "stations_list": station_list,
+                    "preferred_station": _mode(u.stations)
+                })
+
+        energy.sort(key=lambda r: r["avg_monthly_energy_kwh"], reverse=True)
+        frequency.sort(key=lambda r: r["sessions_per_month"], reverse=True)
+        stations.sort(key=lambda r: (r["unique_stations_used"], r["total_sessions"]), reverse=True)
+
+        total_sessions = sum(r["total_sessions"] for r in energy)
+        return {
+            "energy_consumption": energy,
+            "usage_frequency": frequency,
+            "station_mobility": stations,
+            "summary": {
+                "total_users": len(energy),
+                "total_sessions": total_sessions,
+                "total_energy_kwh": sum(r["total_energy_kwh"] or 0 for r in energy),
+                "avg_sessions_per_user": len(energy) > 0 and total_sessions / len(energy) or 0
+            }
+        }
+
+    def _cluster_profiles(self):
+        cluster_analysis = {}
+        for cluster_id in sorted(self.clusters):
+            c = self.clusters[cluster_id]
+            peak_time = _mode(c.times)
+            peak_model = _mode(c.models)
+            times_total = sum(c.times.values())
+            models_total = sum(c.models.values())
+
+            cluster_analysis[cluster_id] = {
+                'cluster_id': cluster_id,
+                'session_count': c.count,
+                'unique_users': len(c.users),
+                'session_profile': _session_profile(c),
+                'metrics': {
+                    'energy': {
+                        'avg_energy_per_session': _round(c.energy.avg, 2),
+                        'total_energy_consumed': _round(c.energy.sum, 2)
+                    },
+                    'cost': {
+                        'avg_cost_per_session': _round(c.cost.avg, 4),
+                        'total_cost': _round(c.cost.sum, 2)
+                    },
+                    'duration': {
+                        'avg_duration': _round(c.duration.avg, 2),
+                        'avg_charging_rate': _round(c.rate.avg, 2)
+                    },
+                    'geographic': {
+                        'unique_stations_used': len(c.stations),
+                        'unique_districts': len(c.districts)
+                    },
+                    'vehicle': {
+                        'avg_battery_capacity': _round(c.battery.avg, 2),
+                        'avg_vehicle_age': _round(c.age.avg, 1),
+                        'avg_distance_driven': _round(c.distance.avg, 2),
+                        'most_common_vehicle': peak_model,
+                        'vehicle_percentage': round(c.models[peak_model] * 100.0 / models_total, 2) if models_total else None
+                    },
+                    'battery': {
+                        'avg_soc_start': _round(c.soc_start.avg, 1),
+                        'avg_soc_end': _round(c.soc_end.avg, 1)
+                    },
+                    'temporal': {
+                        'most_common_time': peak_time,
+                        'most_common_day': _mode(c.days),
+                        'avg_start_hour': _round(c.start_hour.avg, 1),
+                        'peak_time_percentage': round(c.times[peak_time] * 100.0 / times_total, 2) if times_total else None
+                    }
+                }
+            }
+
+        clusters = cluster_analysis.values()
+        return {
+            'success': True,
+            'cluster_analysis': cluster_analysis,
+            'total_clusters': len(cluster_analysis),
+            'summary': {
+                'total_sessions_analyzed': sum(c['session_count'] for c in clusters),
+                'total_energy_consumed': sum(c['metrics']['energy']['total_energy_consumed'] or 0 for c in clusters),
+                'total_cost': sum(c['metrics']['cost']['total_cost'] or 0 for c in clusters),
+                'most_common_profile': max(clusters, key=lambda x: x['session_count'])['session_profile'] if clusters else None
+            }
+        }
+
+    def _user_clusters(self):
+        return {
+            user_id: _mode(self.users[user_id].clusters)
+            for user_id in sorted(self.users)
+            if self.users[user_id].clusters
+        }
@@ -1,20 +1,96 @@
-from psycopg2.extras import RealDictCursor # type: ignore
+from psycopg2.extras import RealDictCursor, execute_values # type: ignore
+from psycopg2 import pool as pg_pool # type: ignore
+from contextlib import contextmanager
+from array import array
 from datetime import date, datetime
-from decimal import Decimal
 import psycopg2 # type: ignore
+import threading
 import json
+import csv
 import time
+import os
 
 from utils import stats as StatsDB
+from utils import migrations as Migrations
+from utils import partitions as Partitions
+
+DB_HOST = os.environ.get("DB_HOST", "db")
+DB_NAME = os.environ.get("DB_NAME", "mydatabase")
+DB_USER = os.environ.get("DB_USER", "user")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "password")
+
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "8"))
+POOL_HEALTHCHECK_IDLE_S = float(os.environ.get("DB_POOL_HEALTHCHECK_IDLE_S", "30"))
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+
+EV_SESSION_INSERT_COLUMNS = [
+    "user_id", "vehicle_model", "battery_capacity_kwh", "station_id",
+    "start_time", "end_time", "energy_consumed_kwh", "duration_h",
+    "charging_rate_kw", "charging_cost_eur", "time_of_day", "day_of_week",
+    "soc_start", "soc_end", "distance_driven_km", "temperature_c", "vehicle_age_years"
+]
+
+# Column order of SELECT * / RETURNING * on ev_session
+EV_SESSION_COLUMNS = ["id"] + EV_SESSION_INSERT_COLUMNS + [
+    "cluster_kmeans", "cluster_dbscan", "clustering_timestamp"
+]
+
+_START_TIME_POS = EV_SESSION_COLUMNS.index("start_time")
+
+EV_SESSION_TIMESTAMP_COLUMNS = {"start_time", "end_time", "clustering_timestamp"}
+
+# Columns the ML service reads (its list schema); the cluster columns are its own output
+EV_SESSION_ML_COLUMNS = ["id"] + EV_SESSION_INSERT_COLUMNS
+
+# Wire type of each column in the binary (columnar) export; anything not listed is "f8"
+EV_SESSION_WIRE_TYPES = {
+    "id": "i8",
+    "user_id": "str", "vehicle_model": "str", "station_id": "str",
+    "time_of_day": "str", "day_of_week": "str",
+    **{column: "ts" for column in EV_SESSION_TIMESTAMP_COLUMNS}
+}
+
+EV_STATION_INSERT_COLUMNS = [
+    "station_id", "distrito", "concelho", "freguesia",
+    "latitude", "longitude", "potencia_max_kw", "num_pontos_ligacao",
+    "cod_distrito", "cod_distrito_concelho", "cod_distrito_concelho_freguesia"
+]
+
+COPY_ROWS_PER_CHUNK = 5000
+
+# Remaining NUMERIC values (e.g. AVG/SUM over integer columns) are read as float instead of Decimal
+NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "NUMERIC_AS_FLOAT",
+    lambda value, cursor: float(value) if value is not None else None
+)
+psycopg2.extensions.register_type(NUMERIC_AS_FLOAT)
+
+# Monthly ev_session partitions: how far ahead to create them and how many months to keep attached (0 = all)
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_RETENTION_MONTHS = int(os.environ.get("PARTITION_RETENTION_MONTHS", "0"))
+# "archive" moves detached partitions to PARTITION_ARCHIVE_SCHEMA, "drop" deletes them
+PARTITION_ARCHIVE_MODE = os.environ.get("PARTITION_ARCHIVE_MODE", "archive")
+PARTITION_ARCHIVE_SCHEMA = os.environ.get("PARTITION_ARCHIVE_SCHEMA", "archive")
+
+# Above this many predictions the write-back is staged through COPY instead of a VALUES list
+BULK_UPDATE_COPY_THRESHOLD = int(os.environ.get("BULK_UPDATE_COPY_THRESHOLD", "10000"))
+
 
 def get_db_connection(max_retries=10, wait_seconds=1):
     for attempt in range(1, max_retries + 1):
         try:
             conn = psycopg2.connect(
-                host="db",
-                database="mydatabase",
-                user="user",
-                password="password"
+                host=DB_HOST,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD
             )
             return conn
 
@@ -25,28 +101,100 @@ def get_db_connection(max_retries=10, wait_seconds=1):
             time.sleep(wait_seconds)
 
 
-def insert_ev_data(json_data):
+class _RetryingPool(pg_pool.ThreadedConnectionPool):
+    # Reuse the retry loop of get_db_connection for every physical connection
+    def _connect(self, key=None):
+        conn = get_db_connection()
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+
+def _get_pool():
+    global _pool, _pool_pid, _pool_slots
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # Connections inherited through fork must not be shared with the parent
+            _pool = _RetryingPool(POOL_MIN_SIZE, POOL_MAX_SIZE)
+            _pool_pid = pid
+            _pool_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+            _last_used.clear()
+            print(f"DB pool ready (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})", flush=True)
+    return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < POOL_HEALTHCHECK_IDLE_S:
+        return True
     try:
-        row = json.loads(json_data)
-    except json.JSONDecodeError:
-        print("Invalid JSON data insert")
-        return
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(pool):
+    while True:
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        print("Discarding broken DB connection from pool", flush=True)
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
 
-    insert_query = """
-        INSERT INTO ev_session (
-            user_id, vehicle_model, battery_capacity_kwh, station_id,
-            start_time, end_time, energy_consumed_kwh, duration_h,
-            charging_rate_kw, charging_cost_eur, time_of_day, day_of_week,
-            soc_start, soc_end, distance_driven_km, temperature_c, vehicle_age_years
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT ON CONSTRAINT unique_session DO NOTHING;
-    """
 
-    cursor.execute(insert_query, (
+@contextmanager
+def get_connection():
+    """
+    Borrows a connection from the process-wide pool.
+    Commits when the block exits cleanly, rolls back on error and always returns the connection.
+    """
+    pool = _get_pool()
+    slots = _pool_slots
+    slots.acquire()
+    conn = None
+    try:
+        conn = _checkout(pool)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    finally:
+        if conn is not None:
+            if conn.closed:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+        slots.release()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _last_used.clear()
+
+
+def _ev_session_values(row):
+    return (
         row.get("\ufeffUser ID"),
         row.get("Vehicle Model"),
         _to_int(row.get("Battery Capacity (kWh)")),
@@ -64,11 +212,51 @@ def insert_ev_data(json_data):
         _to_float(row.get("Distance Driven (since last charge) (km)")),
         _to_float(row.get("Temperature (C)")),
         _to_int(row.get("Vehicle Age (years)"))
-    ))
+    )
+
+
+def _ev_station_values(row):
+    return (
+        row.get("\ufeffStation ID"),
+        row.get("Distrito"),
+        row.get("Concelho"),
+        row.get("Freguesia"),
+        _to_float(row.get("Latitude")),
+        _to_float(row.get("Longitude")),
+        _to_float(row.get("Potência Máxima Admissível (kW)")),
+        _to_int(row.get("Pontos de ligação para instalações de PCVE")),
+        _to_int(row.get("CodDistrito")),
+        _to_int(row.get("CodDistritoConcelho")),
+        _to_int(row.get("CodDistritoConcelhoFreguesia"))
+    )
+
+
+def insert_ev_data(json_data):
+    try:
+        row = json.loads(json_data)
+    except json.JSONDecodeError:
+        print("Invalid JSON data insert")
+        return
+
+    insert_query = """
+        INSERT INTO ev_session (
+            user_id, vehicle_model, battery_capacity_kwh, station_id,
+            start_time, end_time, energy_consumed_kwh, duration_h,
+            charging_rate_kw, charging_cost_eur, time_of_day, day_of_week,
+            soc_start, soc_end, distance_driven_km, temperature_c, vehicle_age_years
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT ON CONSTRAINT unique_session DO NOTHING
+        RETURNING *;
+    """
+
+    # Returns the persisted row, or None when the session already existed
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(insert_query, _ev_session_values(row))
+        inserted = cursor.fetchone()
+        StatsDB.refresh_daily_rollup(conn, _session_days([inserted] if inserted else []))
+        return inserted
 
-    conn.commit()
-    cursor.close()
-    conn.close()
 
 def insert_station_data(json_data):
     try:
@@ -76,9 +264,6 @@ def insert_station_data(json_data):
     except json.JSONDecodeError:
         print("Invalid JSON data insert")
         return
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
     insert_query = """
         INSERT INTO ev_station (
@@ -90,84 +275,243 @@ def insert_station_data(json_data):
         ON CONFLICT (station_id) DO NOTHING;
     """
 
-    cursor.execute(insert_query, (
-        row.get("\ufeffStation ID"),
-        row.get("Distrito"),
-        row.get("Concelho"),
-        row.get("Freguesia"),
-        _to_float(row.get("Latitude")),
-        _to_float(row.get("Longitude")),
-        _to_float(row.get("Potência Máxima Admissível (kW)")),
-        _to_int(row.get("Pontos de ligação para instalações de PCVE")),
-        _to_int(row.get("CodDistrito")),
-        _to_int(row.get("CodDistritoConcelho")),
-        _to_int(row.get("CodDistritoConcelhoFreguesia"))
-    ))
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(insert_query, _ev_station_values(row))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+
+def insert_online_batch(session_rows, station_rows):
+    """
+    Inserts a micro-batch of online sessions (and their stations) with one multi-row statement each.
+    Returns the full ev_session rows that were actually inserted; duplicates skipped by
+    ON CONFLICT are not returned.
+    """
+    if not session_rows:
+        return []
+
+    session_cols = ", ".join(EV_SESSION_INSERT_COLUMNS)
+    station_cols = ", ".join(EV_STATION_INSERT_COLUMNS)
+    station_values = list({v[0]: v for v in (_ev_station_values(r) for r in station_rows)}.values())
+    session_values = [_ev_session_values(r) for r in session_rows]
+
+    with get_connection() as conn, conn.cursor() as cursor:
+        if station_values:
+            execute_values(
+                cursor,
+                f"INSERT INTO ev_station ({station_cols}) VALUES %s ON CONFLICT (station_id) DO NOTHING",
+                station_values,
+                page_size=len(station_values)
+            )
+        inserted = execute_values(
+            cursor,
+            f"""
+            INSERT INTO ev_session ({session_cols}) VALUES %s
+            ON CONFLICT ON CONSTRAINT unique_session DO NOTHING
+            RETURNING *
+            """,
+            session_values,
+            page_size=len(session_values),
+            fetch=True
+        )
+        StatsDB.refresh_daily_rollup(conn, _session_days(inserted))
+
+    return inserted
+
+
+def _session_days(rows):
+    return [row[_START_TIME_POS].date() for row in rows if row[_START_TIME_POS] is not None]
+
+
+class _CopyStream:
+    # Minimal file-like object so copy_expert can pull CSV text from a generator
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = "".join(parts)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _csv_field(value):
+    # Unquoted empty fields are NULL for COPY, quoted ones are empty strings
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def _csv_chunks(values_iter, rows_per_chunk=COPY_ROWS_PER_CHUNK):
+    lines = []
+    for values in values_iter:
+        lines.append(",".join(_csv_field(v) for v in values))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def bulk_load_offline_dataset(ev_csv_path, station_map):
+    """
+    Streams the offline EV dataset into staging tables through COPY and merges it into
+    ev_station / ev_session in a single transaction with the same ON CONFLICT rules as the row inserts.
+    """
+    session_cols = ", ".join(EV_SESSION_INSERT_COLUMNS)
+    station_cols = ", ".join(EV_STATION_INSERT_COLUMNS)
+    used_stations = {}
+    counters = {"rows_read": 0, "rows_staged": 0}
+
+    def session_values():
+        with open(ev_csv_path, newline="", encoding="utf-8") as csvfile:
+            reader = csv.DictReader(csvfile, delimiter=";")
+            for row in reader:
+                counters["rows_read"] += 1
+                station_id = row["Charging Station ID"]
+                station_row = station_map.get(station_id)
+                if not station_row:
+                    continue
+                used_stations[station_id] = station_row
+                counters["rows_staged"] += 1
+                yield _ev_session_values(row)
+
+    started = time.monotonic()
+    with get_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TEMP TABLE ev_session_staging ON COMMIT DROP AS
+            SELECT {session_cols} FROM ev_session WITH NO DATA;
+            ALTER TABLE ev_session_staging ADD COLUMN seq BIGSERIAL;
+
+            CREATE TEMP TABLE ev_station_staging ON COMMIT DROP AS
+            SELECT {station_cols} FROM ev_station WITH NO DATA;
+        """)
+
+        cursor.copy_expert(
+            f"COPY ev_session_staging ({session_cols}) FROM STDIN WITH (FORMAT csv)",
+            _CopyStream(_csv_chunks(session_values()))
+        )
+        cursor.copy_expert(
+            f"COPY ev_station_staging ({station_cols}) FROM STDIN WITH (FORMAT csv)",
+            _CopyStream(_csv_chunks(_ev_station_values(r) for r in used_stations.values()))
+        )
+
+        cursor.execute(f"""
+            INSERT INTO ev_station ({station_cols})
+            SELECT {station_cols} FROM ev_station_staging
+            ON CONFLICT (station_id) DO NOTHING;
+        """)
+        stations_inserted = cursor.rowcount
+
+        cursor.execute(f"""
+            INSERT INTO ev_session ({session_cols})
+            SELECT {session_cols} FROM ev_session_staging
+            ORDER BY seq
+            ON CONFLICT ON CONSTRAINT unique_session DO NOTHING;
+        """)
+        sessions_inserted = cursor.rowcount
+
+        StatsDB.refresh_daily_rollup(conn)
+
+    elapsed = time.monotonic() - started
+    rows_per_s = counters["rows_read"] / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Bulk load: {counters['rows_read']} rows read, {sessions_inserted} sessions and "
+        f"{stations_inserted} stations inserted in {elapsed:.1f}s ({rows_per_s:.0f} rows/s)",
+        flush=True
+    )
+    return {
+        "rows_read": counters["rows_read"],
+        "rows_staged": counters["rows_staged"],
+        "sessions_inserted": sessions_inserted,
+        "stations_inserted": stations_inserted,
+        "elapsed_s": elapsed,
+        "rows_per_s": rows_per_s
+    }
 
 
 def update_cluster_predictions(cluster_results):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    updates = []
+    error_count = 0
+    for session_id, predictions in cluster_results.items():
+        try:
+            updates.append((
+                int(session_id),
+                predictions.get('cluster_kmeans'),
+                predictions.get('cluster_dbscan')
+            ))
+        except (TypeError, ValueError, AttributeError) as e:
+            print(f"Error updating session {session_id}: {e}")
+            error_count += 1
+
     try:
         updated_count = 0
-        error_count = 0
-        
-        for user_id, predictions in cluster_results.items():
-            try:
-                update_query = """
-                UPDATE ev_session 
-                SET 
-                    cluster_kmeans = %s,
-                    cluster_dbscan = %s, 
-                    clustering_timestamp = CURRENT_TIMESTAMP
-                WHERE id = %s
-                """
-                
-                cursor.execute(update_query, (
-                    predictions.get('cluster_kmeans'),
-                    predictions.get('cluster_dbscan'), 
-                    user_id
-                ))
-                
-                if cursor.rowcount > 0:
-                    updated_count += cursor.rowcount
+        if updates:
+            with get_connection() as conn, conn.cursor() as cursor:
+                if len(updates) > BULK_UPDATE_COPY_THRESHOLD:
+                    cursor.execute("""
+                        CREATE TEMP TABLE cluster_updates (
+                            id INTEGER, cluster_kmeans INTEGER, cluster_dbscan INTEGER
+                        ) ON COMMIT DROP;
+                    """)
+                    cursor.copy_expert(
+                        "COPY cluster_updates (id, cluster_kmeans, cluster_dbscan) FROM STDIN WITH (FORMAT csv)",
+                        _CopyStream(_csv_chunks(updates))
+                    )
+                    cursor.execute("""
+                        UPDATE ev_session AS s
+                        SET 
+                            cluster_kmeans = v.cluster_kmeans,
+                            cluster_dbscan = v.cluster_dbscan,
+                            clustering_timestamp = CURRENT_TIMESTAMP
+                        FROM cluster_updates AS v
+                        WHERE s.id = v.id;
+                    """)
                 else:
-                    print(f"Warning: No sessions found for user {user_id}")
-                    error_count += 1
-                    
-            except Exception as e:
-                print(f"Error updating user {user_id}: {e}")
-                error_count += 1
-                continue
-        
-        conn.commit()
+                    execute_values(cursor, """
+                        UPDATE ev_session AS s
+                        SET 
+                            cluster_kmeans = v.cluster_kmeans,
+                            cluster_dbscan = v.cluster_dbscan,
+                            clustering_timestamp = CURRENT_TIMESTAMP
+                        FROM (VALUES %s) AS v(id, cluster_kmeans, cluster_dbscan)
+                        WHERE s.id = v.id
+                    """, updates, template="(%s::int, %s::int, %s::int)", page_size=len(updates))
+                updated_count = cursor.rowcount
+
+        missing = len(updates) - updated_count
+        if missing > 0:
+            print(f"Warning: {missing} predicted sessions were not found")
+            error_count += missing
+
         print(f"Cluster predictions updated successfully!")
         print(f"Updated {updated_count} sessions across {len(cluster_results)} users")
         print(f"Errors: {error_count}")
-        
+
         return {
             "success": True,
             "updated_sessions": updated_count,
             "total_users": len(cluster_results),
             "errors": error_count
         }
-        
+
     except Exception as e:
-        conn.rollback()
         print(f"Error in update_cluster_predictions: {e}")
         return {
             "success": False,
             "error": str(e)
         }
-        
-    finally:
-        cursor.close()
-        conn.close()
 
 
 def _to_float(value):
@@ -195,86 +539,177 @@ def _to_timestamp(value):
         return None
 
 
-def get_last_inserted_session():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _iso_timestamp_sql(column):
+    # Same text as datetime.isoformat(): microseconds only when there are any
+    return (
+        f"to_char({column}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || "
+        f"CASE WHEN date_part('microseconds', {column})::INTEGER % 1000000 <> 0 "
+        f"THEN to_char({column}, '.US') ELSE '' END"
+    )
+
 
-    cursor.execute("""
-            SELECT *
-            FROM ev_session
-            WHERE id = (SELECT MAX(id) FROM ev_session)
-    """)
-    last_session = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    return last_session 
+# SELECT * column order, with timestamps already as ISO text so rows are JSON-ready
+EV_SESSION_EXPORT_SELECT = ", ".join(
+    _iso_timestamp_sql(column) if column in EV_SESSION_TIMESTAMP_COLUMNS else column
+    for column in EV_SESSION_COLUMNS
+)
 
 
 def get_all_ev_sessions():
+    """
+    Returns every session as a tuple in EV_SESSION_COLUMNS order, ready for json.dumps:
+    measurements are floats and timestamps ISO strings.
+    """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        select_query = """
-            SELECT *
+        select_query = f"""
+            SELECT {EV_SESSION_EXPORT_SELECT}
             FROM ev_session;
         """
 
-        cursor.execute(select_query)
-        rows = cursor.fetchall()
+        with get_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(select_query)
+            rows = cursor.fetchall()
 
         if rows:
             return rows
         else:
             print("No EV sessions found in the database!", flush=True)
-        
-        cursor.close()
-        conn.close()
     except Exception as e:
         print(f"Error getting from DB: {e}", flush=True)
 
 
+def get_all_ev_sessions_columnar(batch_size=10000, column_names=EV_SESSION_ML_COLUMNS):
+    """
+    Exports ev_session column by column, in `column_names` order, for the binary ML transport.
+    Returns (columns, count) with columns as [(name, wire type, values)]: ids in an int64 array,
+    numbers and timestamps (epoch seconds) in float64 arrays with NaN for NULL, text in lists.
+    """
+    columns = []
+    select = []
+    for name in column_names:
+        kind = EV_SESSION_WIRE_TYPES.get(name, "f8")
+        # NULL becomes NaN in SQL so float columns go straight into their arrays
+        if kind == "ts":
+            select.append(f"COALESCE(EXTRACT(EPOCH FROM {name})::DOUBLE PRECISION, 'NaN')")
+        elif kind == "f8":
+            select.append(f"COALESCE({name}::DOUBLE PRECISION, 'NaN')")
+        else:
+            select.append(name)
+        columns.append((name, kind, array("q") if kind == "i8" else [] if kind == "str" else array("d")))
+
+    count = 0
+    with get_connection() as conn:
+        # Server-side cursor: the export is built batch by batch instead of from one fetchall
+        with conn.cursor(name="ev_session_export") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(f"SELECT {', '.join(select)} FROM ev_session;")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for (_, _, values), column in zip(columns, zip(*rows)):
+                    values.extend(column)
+                count += len(rows)
+    return columns, count
+
+
+def run_migrations():
+    with get_connection() as conn:
+        return Migrations.apply_migrations(conn)
+
+
+def enable_partitioning():
+    with get_connection() as conn:
+        if Partitions.convert_to_partitioned(conn):
+            print("ev_session converted to monthly partitions", flush=True)
+
+
+def maintain_partitions():
+    """
+    Creates upcoming monthly partitions (moving matching rows out of the default partition)
+    and, when a retention is configured, detaches the partitions older than it.
+    """
+    with get_connection() as conn:
+        created = Partitions.ensure_partitions(conn, PARTITION_MONTHS_AHEAD)
+        detached = []
+        if PARTITION_RETENTION_MONTHS > 0:
+            cutoff = Partitions.months_ago(PARTITION_RETENTION_MONTHS)
+            detached = Partitions.detach_partitions_before(
+                conn, cutoff,
+                archive_schema=PARTITION_ARCHIVE_SCHEMA,
+                drop=PARTITION_ARCHIVE_MODE == "drop"
+            )
+    if created or detached:
+        print(f"Partitions: created {created}, detached {detached}", flush=True)
+    return created, detached
+
+
+def get_archived_rollup_days():
+    # Rollup days older than every session left in ev_session: their partitions were detached
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT day, session_count, energy_sum, energy_count, duration_sum, duration_count, cost_sum
+                FROM ev_session_daily
+                WHERE day < COALESCE((SELECT MIN(start_time)::date FROM ev_session), 'infinity');
+            """)
+            return cursor.fetchall()
+
+
+def iter_dashboard_sessions(batch_size=10000):
+    # Server-side cursor so rebuilding the dashboard aggregates never holds the whole table in memory
+    with get_connection() as conn:
+        with conn.cursor(name="dashboard_sessions", cursor_factory=RealDictCursor) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute("""
+                SELECT 
+                    s.id, s.user_id, s.vehicle_model, s.battery_capacity_kwh, s.station_id,
+                    s.start_time, s.energy_consumed_kwh, s.duration_h, s.charging_rate_kw,
+                    s.charging_cost_eur, s.time_of_day, s.day_of_week, s.soc_start, s.soc_end,
+                    s.distance_driven_km, s.temperature_c, s.vehicle_age_years, s.cluster_kmeans,
+                    st.distrito
+                FROM ev_session s
+                LEFT JOIN ev_station st ON s.station_id = st.station_id;
+            """)
+            for row in cursor:
+                yield row
+
+
 def get_daily_weekly_monthly_trends():
     try:
-        conn = get_db_connection()
-        result = StatsDB.get_daily_weekly_monthly_trends(conn)
-        return result
+        with get_connection() as conn:
+            return StatsDB.get_daily_weekly_monthly_trends(conn)
     except Exception as e:
         print(f"Error connecting to DB: {e}")
 
 
 def get_time_of_day_distribution():
     try:
-        conn = get_db_connection()
-        result = StatsDB.get_time_of_day_distribution(conn)
-        return result
+        with get_connection() as conn:
+            return StatsDB.get_time_of_day_distribution(conn)
     except Exception as e:
         print(f"Error connecting to DB: {e}")
 
 
 def get_user_behavior_patterns():
     try:
-        conn = get_db_connection()
-        result = StatsDB.get_user_behavior_patterns(conn)
-        return result
+        with get_connection() as conn:
+            return StatsDB.get_user_behavior_patterns(conn)
     except Exception as e:
         print(f"Error connecting to DB: {e}")
 
 def get_cluster_profiles():
     try:
-        conn = get_db_connection()
-        result = StatsDB.analyze_cluster_profiles(conn)
-        return result
+        with get_connection() as conn:
+            return StatsDB.analyze_cluster_profiles(conn)
     except Exception as e:
         print(f"Error connecting to DB: {e}")
 
 
 def get_user_clusters():
     try:
-        conn = get_db_connection()
-        result = StatsDB.get_user_clusters(conn)
-        return result
+        with get_connection() as conn:
+            return StatsDB.get_user_clusters(conn)
     except Exception as e:
         print(f"Error connecting to DB: {e}")
 
@@ -282,8 +717,6 @@ def get_user_clusters():
 def make_json_safe(obj):
     if isinstance(obj, (datetime, date)):
         return obj.isoformat()
-    if isinstance(obj, Decimal):
-        return float(obj)
     if isinstance(obj, tuple):
         return [make_json_safe(x) for x in obj]
     if isinstance(obj, list):
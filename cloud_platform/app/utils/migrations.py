@@ -0,0 +1,76 @@
+import os
+import re
+
+# Ficheiros NNN_descricao.sql, aplicados por ordem de versão e uma única vez
+MIGRATIONS_DIR = os.environ.get(
+    "MIGRATIONS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+)
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_(.+)\.sql$")
+
+# Chave do advisory lock: vários processos a arrancar ao mesmo tempo aplicam cada migração uma vez
+_LOCK_KEY = 20250116
+
+SCHEMA_MIGRATIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def apply_migrations(conn, directory=MIGRATIONS_DIR):
+    """
+    Aplica as migrações pendentes, cada uma na sua própria transação (faz commit).
+    Devolve a lista de versões aplicadas nesta chamada.
+    """
+    cursor = conn.cursor()
+    applied_now = []
+    try:
+        cursor.execute("SELECT pg_advisory_lock(%s);", (_LOCK_KEY,))
+        try:
+            cursor.execute(SCHEMA_MIGRATIONS)
+            conn.commit()
+
+            cursor.execute("SELECT version FROM schema_migrations;")
+            applied = {row[0] for row in cursor.fetchall()}
+
+            for version, name, path in list_migrations(directory):
+                if version in applied:
+                    continue
+                with open(path, encoding="utf-8") as sql_file:
+                    sql = sql_file.read()
+                try:
+                    cursor.execute(sql)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                        (version, name)
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied_now.append(version)
+                print(f"Applied migration {version:03d}_{name}", flush=True)
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (_LOCK_KEY,))
+            conn.commit()
+    finally:
+        cursor.close()
+    return applied_now
@@ -0,0 +1,105 @@
+from array import array
+import sys
+
+import msgpack # type: ignore
+import requests
+
+# Binary transport to ml_processor: msgpack with columnar session batches.
+# Each column travels as one typed array (little-endian bytes) instead of one JSON value per cell:
+#   "i8"  -> int64, "f8" -> float64 (NaN = null), "ts" -> float64 epoch seconds (NaN = null),
+#   "cat" -> text, dictionary-encoded: {"values": [distinct str], "codes": int bytes (-1 = null), "width": 1|2|4}.
+MSGPACK_MIME = "application/x-msgpack"
+COLUMNAR_FORMAT = "columnar/v1"
+
+_ARRAY_TYPECODES = {"i8": "q", "f8": "d", "ts": "d"}
+_CODE_TYPECODES = {1: "b", 2: "h", 4: "i"}
+
+
+def _array_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_array_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _dictionary_encode(values):
+    # Session text columns (user, model, station, time of day...) repeat a small set of values
+    index = {}
+    codes = array("i")
+    for value in values:
+        if value is None:
+            codes.append(-1)
+        else:
+            codes.append(index.setdefault(value, len(index)))
+    # Narrowest signed code width that fits the dictionary (-1 stays free for null)
+    width = 1 if len(index) < 2 ** 7 else 2 if len(index) < 2 ** 15 else 4
+    if width < 4:
+        codes = array(_CODE_TYPECODES[width], codes)
+    return {"values": list(index), "codes": _array_bytes(codes), "width": width}
+
+
+def _to_wire(kind, values):
+    if kind == "str":
+        return "cat", _dictionary_encode(values)
+    return kind, _array_bytes(values)
+
+
+def _from_wire(kind, data):
+    if kind == "cat":
+        distinct = data["values"]
+        codes = _from_array_bytes(_CODE_TYPECODES[data["width"]], data["codes"])
+        return [distinct[code] if code >= 0 else None for code in codes]
+    return _from_array_bytes(_ARRAY_TYPECODES[kind], data)
+
+
+def encode_columns(columns, count):
+    """columns: [(name, type, values)] with array values for i8/f8/ts and lists for str."""
+    encoded = []
+    for name, kind, values in columns:
+        wire_kind, data = _to_wire(kind, values)
+        encoded.append({"name": name, "type": wire_kind, "data": data})
+    return {"format": COLUMNAR_FORMAT, "count": count, "columns": encoded}
+
+
+def decode_columns(block):
+    return {column["name"]: _from_wire(column["type"], column["data"]) for column in block["columns"]}
+
+
+def decode_predictions(results):
+    # Predictions come back columnar (id, cluster_kmeans, cluster_dbscan) or as the JSON-style dict
+    if not isinstance(results, dict) or results.get("format") != COLUMNAR_FORMAT:
+        return results
+    columns = decode_columns(results)
+    return {
+        session_id: {"cluster_kmeans": kmeans, "cluster_dbscan": dbscan}
+        for session_id, kmeans, dbscan in zip(columns["id"], columns["cluster_kmeans"], columns["cluster_dbscan"])
+    }
+
+
+def send_sessions(method, url, columns, count, **fields):
+    """
+    Sends the sessions as a msgpack columnar batch under "ev_sessions" (plus any extra fields)
+    and asks for a msgpack reply. Returns (status_code, result dict); a JSON reply is also accepted.
+    """
+    payload = dict(fields, ev_sessions=encode_columns(columns, count))
+    response = requests.request(
+        method,
+        url,
+        data=msgpack.packb(payload, use_bin_type=True),
+        headers={"Content-Type": MSGPACK_MIME, "Accept": MSGPACK_MIME}
+    )
+    if response.headers.get("Content-Type", "").startswith(MSGPACK_MIME):
+        result = msgpack.unpackb(response.content, raw=False, strict_map_key=False)
+    else:
+        result = response.json()
+    if "results" in result:
+        result["results"] = decode_predictions(result["results"])
+    return response.status_code, result
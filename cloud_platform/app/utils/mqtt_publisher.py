@@ -21,6 +21,12 @@ class MqttPublisher:
         self.client.tls_set(ca_certs="certs/ca.crt")
         self.client.username_pw_set("username", "senha123")
         self.client.connect(BROKER_ADDRESS, BROKER_PORT, 60)
+        # Background network loop keeps the connection alive (and reconnects) between publishes
+        self.client.loop_start()
+
+    def disconnect(self):
+        self.client.disconnect()
+        self.client.loop_stop()
 
     def start(self):
         try:
@@ -29,5 +35,5 @@ class MqttPublisher:
             print("Stopping subscriber...")
             self.client.disconnect()
 
-    def publish(self, payload):
-        self.client.publish(TOPIC_EV, payload)
\ No newline at end of file
+    def publish(self, payload, topic=TOPIC_EV, retain=False, qos=0):
+        self.client.publish(topic, payload, qos=qos, retain=retain)
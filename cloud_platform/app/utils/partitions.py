@@ -0,0 +1,219 @@
+from datetime import date
+import re
+
+# Particionamento mensal (RANGE em start_time) de ev_session, opcional.
+#
+# Numa tabela particionada as restrições únicas têm de incluir a chave de partição:
+# unique_session (user_id, station_id, start_time) já inclui, a primary key em id não.
+# O id continua a vir da mesma sequência e fica com um índice normal.
+# Sessões sem start_time (ou fora das partições mensais) vão para a partição default.
+
+SESSION_TABLE = "ev_session"
+DEFAULT_PARTITION = "ev_session_default"
+
+_PARTITION_NAME = re.compile(r"^ev_session_(\d{4})_(\d{2})$")
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_ago(count, today=None):
+    return _add_months(_month_start(today or date.today()), -count)
+
+
+def partition_name(month):
+    return f"{SESSION_TABLE}_{month:%Y_%m}"
+
+
+def is_partitioned(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass;", (SESSION_TABLE,))
+        return cursor.fetchone()[0] == "p"
+    finally:
+        cursor.close()
+
+
+def list_partitions(conn):
+    """Devolve {mês: nome} das partições mensais ligadas a ev_session (sem a default)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass;
+        """, (SESSION_TABLE,))
+        partitions = {}
+        for (name,) in cursor.fetchall():
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return partitions
+    finally:
+        cursor.close()
+
+
+def convert_to_partitioned(conn):
+    """
+    Converte ev_session (tabela normal) numa tabela particionada por mês, com as
+    partições necessárias para os dados existentes. Não faz nada se já estiver
+    particionada. Não faz commit: corre na transação de quem chama.
+    """
+    if is_partitioned(conn):
+        return False
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"LOCK TABLE {SESSION_TABLE} IN ACCESS EXCLUSIVE MODE;")
+
+        # Índices que não suportam constraints (idx_* de init.sql e das migrações) são recriados tal e qual
+        cursor.execute("""
+            SELECT indexdef
+            FROM pg_indexes i
+            WHERE schemaname = current_schema() AND tablename = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_constraint c
+                  WHERE c.conindid = (quote_ident(i.schemaname) || '.' || quote_ident(i.indexname))::regclass
+              );
+        """, (SESSION_TABLE,))
+        index_definitions = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT conname, contype
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype IN ('p', 'u');
+        """, (SESSION_TABLE,))
+        constraints = cursor.fetchall()
+
+        legacy_table = f"{SESSION_TABLE}_unpartitioned"
+        cursor.execute(f"ALTER TABLE {SESSION_TABLE} RENAME TO {legacy_table};")
+        for name, _ in constraints:
+            cursor.execute(f"ALTER TABLE {legacy_table} DROP CONSTRAINT {name};")
+        cursor.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = %s;
+        """, (legacy_table,))
+        for (index_name,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX {index_name};")
+
+        cursor.execute(f"""
+            CREATE TABLE {SESSION_TABLE}
+            (LIKE {legacy_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE (start_time);
+        """)
+        # A sequência do id passa para a tabela nova antes de a antiga ser removida
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id');", (legacy_table,))
+        id_sequence = cursor.fetchone()[0]
+        if id_sequence:
+            cursor.execute(f"ALTER SEQUENCE {id_sequence} OWNED BY {SESSION_TABLE}.id;")
+
+        cursor.execute(f"""
+            ALTER TABLE {SESSION_TABLE}
+            ADD CONSTRAINT unique_session UNIQUE (user_id, station_id, start_time),
+            ADD FOREIGN KEY (station_id) REFERENCES ev_station(station_id);
+        """)
+        if not any(definition.endswith("(id)") for definition in index_definitions):
+            cursor.execute(f"CREATE INDEX idx_ev_session_id ON {SESSION_TABLE}(id);")
+        for definition in index_definitions:
+            cursor.execute(definition)
+
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {SESSION_TABLE} DEFAULT;")
+
+        cursor.execute(f"""
+            SELECT DISTINCT DATE_TRUNC('month', start_time)::date
+            FROM {legacy_table}
+            WHERE start_time IS NOT NULL;
+        """)
+        for (month,) in cursor.fetchall():
+            _create_partition(cursor, month)
+
+        cursor.execute(f"INSERT INTO {SESSION_TABLE} SELECT * FROM {legacy_table};")
+        cursor.execute(f"DROP TABLE {legacy_table};")
+        cursor.execute(f"ANALYZE {SESSION_TABLE};")
+        return True
+    finally:
+        cursor.close()
+
+
+def _create_partition(cursor, month):
+    # Cria a partição à parte, move para lá as linhas do mês que estejam na default
+    # e só depois a liga (ATTACH falharia com essas linhas ainda na default)
+    name = partition_name(month)
+    lower, upper = month, _add_months(month, 1)
+    cursor.execute(f"""
+        CREATE TABLE {name}
+        (LIKE {SESSION_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+    """)
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE start_time >= %s AND start_time < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved;
+    """, (lower, upper))
+    cursor.execute(f"""
+        ALTER TABLE {SESSION_TABLE} ATTACH PARTITION {name}
+        FOR VALUES FROM (%s) TO (%s);
+    """, (lower, upper))
+    return name
+
+
+def ensure_partitions(conn, months_ahead=3, today=None):
+    """
+    Garante partições do mês atual até `months_ahead` meses à frente, e para
+    qualquer mês com sessões paradas na partição default (ex.: dataset offline).
+    Não faz commit. Devolve os nomes das partições criadas.
+    """
+    current = _month_start(today or date.today())
+    months = {_add_months(current, offset) for offset in range(months_ahead + 1)}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT DISTINCT DATE_TRUNC('month', start_time)::date
+            FROM {DEFAULT_PARTITION}
+            WHERE start_time IS NOT NULL;
+        """)
+        months.update(row[0] for row in cursor.fetchall())
+
+        existing = list_partitions(conn)
+        created = [_create_partition(cursor, month) for month in sorted(months - set(existing))]
+        if created:
+            cursor.execute(f"ANALYZE {SESSION_TABLE};")
+        return created
+    finally:
+        cursor.close()
+
+
+def detach_partitions_before(conn, cutoff, archive_schema="archive", drop=False):
+    """
+    Desliga as partições mensais que acabam antes de `cutoff`. Por omissão ficam
+    como tabelas normais em `archive_schema`; com drop=True são apagadas.
+    O resumo diário (ev_session_daily) mantém os dias dessas partições.
+    Não faz commit. Devolve os nomes das partições desligadas.
+    """
+    cutoff = _month_start(cutoff)
+    cursor = conn.cursor()
+    try:
+        detached = []
+        for month, name in sorted(list_partitions(conn).items()):
+            if _add_months(month, 1) > cutoff:
+                continue
+            cursor.execute(f"ALTER TABLE {SESSION_TABLE} DETACH PARTITION {name};")
+            if drop:
+                cursor.execute(f"DROP TABLE {name};")
+            elif archive_schema:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema};")
+                cursor.execute(f"ALTER TABLE {name} SET SCHEMA {archive_schema};")
+            detached.append(name)
+        return detached
+    finally:
+        cursor.close()
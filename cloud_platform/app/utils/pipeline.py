@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+
+class Stage:
+    """
+    One step of a StagedPipeline. `concurrency` workers take items from the stage's bounded
+    queue, await `handler(item)` and put results that are not None on the next stage's queue,
+    waiting while it is full. With `batch_size` > 1 a worker hands the handler a list of up to
+    `batch_size` items, collected for at most `linger_ms` after the first one arrived.
+    """
+
+    def __init__(self, name, handler, concurrency=1, queue_size=100, batch_size=1, linger_ms=0):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, int(concurrency))
+        self.queue_size = max(1, int(queue_size))
+        self.batch_size = max(1, int(batch_size))
+        self.linger_s = max(0.0, linger_ms / 1000.0)
+        self.queue = None
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+
+    def status(self):
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed
+        }
+
+    async def _next_items(self):
+        item = await self.queue.get()
+        if self.batch_size == 1:
+            return item
+
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.linger_s
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _work(self, next_stage):
+        while True:
+            items = await self._next_items()
+            self.in_flight += 1
+            try:
+                result = await self.handler(items)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Pipeline stage {self.name} failed: {e}", flush=True)
+                result = None
+            finally:
+                self.in_flight -= 1
+
+            if result is not None and next_stage is not None:
+                await next_stage.queue.put(result)
+
+
+class StagedPipeline:
+    """
+    Runs `stages` on an asyncio loop in a background thread, each feeding the next through its
+    bounded queue. Other threads hand work in with submit(), which never blocks: when the first
+    queue is full the item is dropped and counted. Every `status_interval_s` the queue depths are
+    passed to `on_status` (on the loop thread, so it must not block either).
+    """
+
+    def __init__(self, stages, on_status=None, status_interval_s=5.0, name="pipeline"):
+        self.stages = stages
+        self.on_status = on_status
+        self.status_interval_s = status_interval_s
+        self.dropped = 0
+        self._loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+
+    def submit(self, item):
+        self._loop.call_soon_threadsafe(self._offer, item)
+
+    def status(self):
+        status = {stage.name: stage.status() for stage in self.stages}
+        status["dropped"] = self.dropped
+        return status
+
+    def _offer(self, item):
+        try:
+            self.stages[0].queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"Pipeline input full, {self.dropped} items dropped so far", flush=True)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self):
+        # Queues are created here so they belong to this loop
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+
+        workers = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            workers.extend(asyncio.ensure_future(stage._work(next_stage)) for _ in range(stage.concurrency))
+        if self.on_status is not None:
+            workers.append(asyncio.ensure_future(self._report_status()))
+
+        self._ready.set()
+        await asyncio.gather(*workers)
+
+    async def _report_status(self):
+        while True:
+            await asyncio.sleep(self.status_interval_s)
+            try:
+                self.on_status(self.status())
+            except Exception as e:
+                print(f"Pipeline status report failed: {e}", flush=True)
+
+
+async def run_blocking(executor, fn, *args):
+    # Blocking calls (psycopg2) run on the stage's own threads, never on the loop
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
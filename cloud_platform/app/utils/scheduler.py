@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class CoalescingScheduler:
+    """
+    Runs `action` on a background thread in response to trigger() calls, merging bursts of
+    triggers into a single run. A run starts once no trigger arrived for `debounce_s`, or once
+    the oldest pending trigger is `max_staleness_s` old, and never sooner than `min_interval_s`
+    after the previous run started.
+    """
+
+    def __init__(self, action, min_interval_s=2.0, debounce_s=0.5, max_staleness_s=10.0, name="scheduler"):
+        self.action = action
+        self.min_interval_s = min_interval_s
+        self.debounce_s = debounce_s
+        self.max_staleness_s = max_staleness_s
+        self._cond = threading.Condition()
+        self._first_pending = None
+        self._last_trigger = None
+        self._last_run = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def trigger(self):
+        with self._cond:
+            now = time.monotonic()
+            if self._first_pending is None:
+                self._first_pending = now
+            self._last_trigger = now
+            self._cond.notify()
+
+    def stop(self, timeout=None):
+        # Pending triggers are flushed before the thread exits
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _due_at(self):
+        due = min(self._last_trigger + self.debounce_s, self._first_pending + self.max_staleness_s)
+        if self._last_run is not None:
+            due = max(due, self._last_run + self.min_interval_s)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._first_pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._first_pending is None:
+                    return
+                while not self._stopped:
+                    wait = self._due_at() - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                self._first_pending = None
+                self._last_trigger = None
+
+            self._last_run = time.monotonic()
+            try:
+                self.action()
+            except Exception as e:
+                print(f"Error in scheduled {self._thread.name}: {e}", flush=True)
@@ -1,59 +1,126 @@
 from psycopg2.extras import RealDictCursor # type: ignore
 
+ROLLUP_AGGREGATES = """
+    COUNT(*),
+    SUM(energy_consumed_kwh),
+    COUNT(energy_consumed_kwh),
+    SUM(duration_h),
+    COUNT(duration_h),
+    SUM(charging_cost_eur)
+"""
+
+# Namespace dos advisory locks por dia do refresh incremental (a segunda chave é o dia)
+_ROLLUP_LOCK_NAMESPACE = 20250117
+
+
+def refresh_daily_rollup(conn, days=None):
+    """
+    Recalcula o resumo diário (ev_session_daily) a partir de ev_session.
+    Sem `days` reconstrói a tabela a partir da sessão mais antiga (os dias anteriores,
+    de partições já arquivadas, ficam); com `days` só recalcula esses dias.
+    Não faz commit: corre na transação de quem chama.
+    """
+    cursor = conn.cursor()
+
+    try:
+        if days is None:
+            cursor.execute("""
+            DELETE FROM ev_session_daily
+            WHERE day >= COALESCE((SELECT MIN(start_time)::date FROM ev_session), '-infinity');
+            """)
+            cursor.execute(f"""
+            INSERT INTO ev_session_daily (
+                day, session_count, energy_sum, energy_count, duration_sum, duration_count, cost_sum
+            )
+            SELECT DATE(start_time), {ROLLUP_AGGREGATES}
+            FROM ev_session
+            WHERE start_time IS NOT NULL
+            GROUP BY DATE(start_time);
+            """)
+            return
+
+        days = sorted(set(days))
+        if not days:
+            return
+
+        # Refreshes concorrentes do mesmo dia (lotes online em paralelo) ficam em série até ao commit:
+        # sem isto, o último a escrever podia gravar contagens que não viam as sessões do outro
+        cursor.execute("""
+            SELECT pg_advisory_xact_lock(%s, d - DATE '2000-01-01')
+            FROM (SELECT d FROM unnest(%s::date[]) AS d ORDER BY d) AS ordered;
+        """, (_ROLLUP_LOCK_NAMESPACE, days))
+        # Range predicates per day so an index on start_time can serve the refresh
+        cursor.execute("DELETE FROM ev_session_daily WHERE day = ANY(%s::date[]);", (days,))
+        cursor.execute(f"""
+        INSERT INTO ev_session_daily (
+            day, session_count, energy_sum, energy_count, duration_sum, duration_count, cost_sum
+        )
+        SELECT d.day, {ROLLUP_AGGREGATES}
+        FROM unnest(%s::date[]) AS d(day)
+        JOIN ev_session ON start_time >= d.day AND start_time < d.day + 1
+        GROUP BY d.day
+        ON CONFLICT (day) DO UPDATE SET
+            session_count = EXCLUDED.session_count,
+            energy_sum = EXCLUDED.energy_sum,
+            energy_count = EXCLUDED.energy_count,
+            duration_sum = EXCLUDED.duration_sum,
+            duration_count = EXCLUDED.duration_count,
+            cost_sum = EXCLUDED.cost_sum;
+        """, (days,))
+    finally:
+        cursor.close()
+
+
 def get_daily_weekly_monthly_trends(conn):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # Daily trends query
+        # Daily trends query (lê do resumo diário, não de ev_session)
         daily_query = """
         SELECT 
-            DATE(start_time) as date,
-            COUNT(*) as session_count,
-            SUM(energy_consumed_kwh) as total_energy,
-            AVG(energy_consumed_kwh) as avg_energy,
-            AVG(duration_h) as avg_duration,
-            SUM(charging_cost_eur) as total_cost
-        FROM ev_session 
-        WHERE start_time IS NOT NULL
-        GROUP BY DATE(start_time)
+            day as date,
+            session_count,
+            energy_sum as total_energy,
+            energy_sum / NULLIF(energy_count, 0) as avg_energy,
+            duration_sum / NULLIF(duration_count, 0) as avg_duration,
+            cost_sum as total_cost
+        FROM ev_session_daily
         ORDER BY date;
         """
         
         cursor.execute(daily_query)
         daily_trends = cursor.fetchall()
     
-        # Weekly trends query
+        # Weekly trends query (derivado do resumo diário)
         weekly_query = """
         SELECT 
-            EXTRACT(YEAR FROM start_time) as year,
-            EXTRACT(WEEK FROM start_time) as week,
-            COUNT(*) as session_count,
-            SUM(energy_consumed_kwh) as total_energy,
-            AVG(energy_consumed_kwh) as avg_energy,
-            AVG(duration_h) as avg_duration,
-            SUM(charging_cost_eur) as total_cost
-        FROM ev_session 
-        WHERE start_time IS NOT NULL
-        GROUP BY EXTRACT(YEAR FROM start_time), EXTRACT(WEEK FROM start_time)
+            EXTRACT(YEAR FROM day) as year,
+            EXTRACT(WEEK FROM day) as week,
+            SUM(session_count) as session_count,
+            SUM(energy_sum) as total_energy,
+            SUM(energy_sum) / NULLIF(SUM(energy_count), 0) as avg_energy,
+            SUM(duration_sum) / NULLIF(SUM(duration_count), 0) as avg_duration,
+            SUM(cost_sum) as total_cost
+        FROM ev_session_daily
+        GROUP BY EXTRACT(YEAR FROM day), EXTRACT(WEEK FROM day)
         ORDER BY year, week;
         """
         
         cursor.execute(weekly_query)
         weekly_trends = cursor.fetchall()
         
-        # Monthly trends query
+        # Monthly trends query (derivado do resumo diário)
         monthly_query = """
         SELECT 
-            EXTRACT(YEAR FROM start_time) as year,
-            EXTRACT(MONTH FROM start_time) as month,
-            COUNT(*) as session_count,
-            SUM(energy_consumed_kwh) as total_energy,
-            AVG(energy_consumed_kwh) as avg_energy,
-            AVG(duration_h) as avg_duration,
-            SUM(charging_cost_eur) as total_cost
-        FROM ev_session 
-        WHERE start_time IS NOT NULL
-        GROUP BY EXTRACT(YEAR FROM start_time), EXTRACT(MONTH FROM start_time)
+            EXTRACT(YEAR FROM day) as year,
+            EXTRACT(MONTH FROM day) as month,
+            SUM(session_count) as session_count,
+            SUM(energy_sum) as total_energy,
+            SUM(energy_sum) / NULLIF(SUM(energy_count), 0) as avg_energy,
+            SUM(duration_sum) / NULLIF(SUM(duration_count), 0) as avg_duration,
+            SUM(cost_sum) as total_cost
+        FROM ev_session_daily
+        GROUP BY EXTRACT(YEAR FROM day), EXTRACT(MONTH FROM day)
         ORDER BY year, month;
         """
         
@@ -78,7 +145,6 @@ def get_daily_weekly_monthly_trends(conn):
         return {"error": str(e)}
     finally:
         cursor.close()
-        conn.close()
 
 
 def get_time_of_day_distribution(conn):
@@ -111,94 +177,114 @@ def get_time_of_day_distribution(conn):
         return {"error": str(e)}
     finally:
         cursor.close()
-        conn.close()
 
 
 def get_user_behavior_patterns(conn):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # Query 1: Consumo Mensal de Energia por User
-        energy_query = """
+        # Uma única passagem por ev_session agrupada por user; as três secções
+        # (energia, frequência, estações) saem de agregados com FILTER
+        query = """
+        WITH per_user AS (
+            SELECT 
+                user_id,
+
+                -- Energia (sessões com energia e início)
+                COUNT(*) FILTER (WHERE energy_consumed_kwh IS NOT NULL AND start_time IS NOT NULL) as energy_sessions,
+                SUM(energy_consumed_kwh) FILTER (WHERE start_time IS NOT NULL) as total_energy_kwh,
+                COUNT(DISTINCT DATE_TRUNC('month', start_time)) FILTER (WHERE energy_consumed_kwh IS NOT NULL) as energy_months,
+                MIN(start_time) FILTER (WHERE energy_consumed_kwh IS NOT NULL) as first_energy_session,
+                MAX(start_time) FILTER (WHERE energy_consumed_kwh IS NOT NULL) as last_energy_session,
+
+                -- Frequência (sessões com início)
+                COUNT(start_time) as timed_sessions,
+                COUNT(DISTINCT DATE(start_time)) as unique_days_used,
+                COUNT(DISTINCT DATE_TRUNC('month', start_time)) as months_active,
+                MIN(start_time) as first_session,
+                MAX(start_time) as last_session,
+
+                -- Estações (sessões com estação); empates na preferida resolvidos pelo menor id
+                COUNT(station_id) as station_sessions,
+                COUNT(DISTINCT station_id) as unique_stations_used,
+                ARRAY_AGG(DISTINCT station_id) FILTER (WHERE station_id IS NOT NULL) as stations_list,
+                MODE() WITHIN GROUP (ORDER BY station_id) as preferred_station
+            FROM ev_session 
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        )
         SELECT 
-            user_id,
-            COUNT(*) as total_sessions,
-            SUM(energy_consumed_kwh) as total_energy_kwh,
-            COUNT(DISTINCT DATE_TRUNC('month', start_time)) as months_active,
+            *,
             CASE 
-                WHEN COUNT(DISTINCT DATE_TRUNC('month', start_time)) > 0 
-                THEN SUM(energy_consumed_kwh) / COUNT(DISTINCT DATE_TRUNC('month', start_time))
-                ELSE SUM(energy_consumed_kwh)
+                WHEN energy_months > 0 
+                THEN total_energy_kwh / energy_months
+                ELSE total_energy_kwh
             END as avg_monthly_energy_kwh,
-            MIN(start_time) as first_session,
-            MAX(start_time) as last_session
-        FROM ev_session 
-        WHERE user_id IS NOT NULL 
-          AND energy_consumed_kwh IS NOT NULL
-          AND start_time IS NOT NULL
-        GROUP BY user_id
-        ORDER BY avg_monthly_energy_kwh DESC;
-        """
-        
-        cursor.execute(energy_query)
-        energy_patterns = cursor.fetchall()
-        
-        # Query 2: Frequência de Utilização por User
-        frequency_query = """
-        SELECT 
-            user_id,
-            COUNT(*) as total_sessions,
-            COUNT(DISTINCT DATE(start_time)) as unique_days_used,
-            COUNT(DISTINCT DATE_TRUNC('month', start_time)) as months_active,
             CASE 
-                WHEN COUNT(DISTINCT DATE_TRUNC('month', start_time)) > 0 
-                THEN COUNT(*)::FLOAT / COUNT(DISTINCT DATE_TRUNC('month', start_time))
-                ELSE COUNT(*)::FLOAT
+                WHEN months_active > 0 
+                THEN timed_sessions::FLOAT / months_active
+                ELSE timed_sessions::FLOAT
             END as sessions_per_month,
             CASE 
-                WHEN COUNT(DISTINCT DATE(start_time)) > 0 
-                THEN COUNT(*)::FLOAT / COUNT(DISTINCT DATE(start_time))
+                WHEN unique_days_used > 0 
+                THEN timed_sessions::FLOAT / unique_days_used
                 ELSE 1
             END as sessions_per_day_avg,
-            MIN(start_time) as first_session,
-            MAX(start_time) as last_session
-        FROM ev_session 
-        WHERE user_id IS NOT NULL 
-          AND start_time IS NOT NULL
-        GROUP BY user_id
-        ORDER BY sessions_per_month DESC;
-        """
-        
-        cursor.execute(frequency_query)
-        frequency_patterns = cursor.fetchall()
-        
-        # Query 3: Quantidade de Estações Diferentes por User
-        stations_query = """
-        SELECT 
-            user_id,
-            COUNT(*) as total_sessions,
-            COUNT(DISTINCT station_id) as unique_stations_used,
             CASE 
-                WHEN COUNT(*) > 0 
-                THEN COUNT(DISTINCT station_id)::FLOAT / COUNT(*)
+                WHEN station_sessions > 0 
+                THEN unique_stations_used::FLOAT / station_sessions
                 ELSE 0 
-            END as station_variety_ratio,
-            ARRAY_AGG(DISTINCT station_id) as stations_list,
-            (SELECT station_id 
-             FROM ev_session es2 
-             WHERE es2.user_id = ev_session.user_id 
-             GROUP BY station_id 
-             ORDER BY COUNT(*) DESC 
-             LIMIT 1) as preferred_station
-        FROM ev_session 
-        WHERE user_id IS NOT NULL 
-          AND station_id IS NOT NULL
-        GROUP BY user_id
-        ORDER BY unique_stations_used DESC, total_sessions DESC;
+            END as station_variety_ratio
+        FROM per_user;
         """
         
-        cursor.execute(stations_query)
-        stations_patterns = cursor.fetchall()
+        cursor.execute(query)
+        users = cursor.fetchall()
+
+        # Query 1: Consumo Mensal de Energia por User
+        energy_patterns = [
+            {
+                "user_id": u["user_id"],
+                "total_sessions": u["energy_sessions"],
+                "total_energy_kwh": u["total_energy_kwh"],
+                "months_active": u["energy_months"],
+                "avg_monthly_energy_kwh": u["avg_monthly_energy_kwh"],
+                "first_session": u["first_energy_session"],
+                "last_session": u["last_energy_session"]
+            }
+            for u in users if u["energy_sessions"] > 0
+        ]
+        energy_patterns.sort(key=lambda u: u["avg_monthly_energy_kwh"], reverse=True)
+
+        # Query 2: Frequência de Utilização por User
+        frequency_patterns = [
+            {
+                "user_id": u["user_id"],
+                "total_sessions": u["timed_sessions"],
+                "unique_days_used": u["unique_days_used"],
+                "months_active": u["months_active"],
+                "sessions_per_month": u["sessions_per_month"],
+                "sessions_per_day_avg": u["sessions_per_day_avg"],
+                "first_session": u["first_session"],
+                "last_session": u["last_session"]
+            }
+            for u in users if u["timed_sessions"] > 0
+        ]
+        frequency_patterns.sort(key=lambda u: u["sessions_per_month"], reverse=True)
+
+        # Query 3: Quantidade de Estações Diferentes por User
+        stations_patterns = [
+            {
+                "user_id": u["user_id"],
+                "total_sessions": u["station_sessions"],
+                "unique_stations_used": u["unique_stations_used"],
+                "station_variety_ratio": u["station_variety_ratio"],
+                "stations_list": u["stations_list"],
+                "preferred_station": u["preferred_station"]
+            }
+            for u in users if u["station_sessions"] > 0
+        ]
+        stations_patterns.sort(key=lambda u: (u["unique_stations_used"], u["total_sessions"]), reverse=True)
         
         # Combinar os resultados
         result = {
@@ -428,7 +514,6 @@ def get_user_clusters(conn):
     rows = cursor.fetchall()
 
     cursor.close()
-    conn.close()
 
     # Converte para um dicionário (opcional)
     result = {user_id: cluster for user_id, cluster in rows}
@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+from utils.mqtt_publisher import TOPIC_EV
+
+
+def _encode(content):
+    # Canonical encoding so equal content always hashes the same
+    return json.dumps(content, sort_keys=True, separators=(",", ":"))
+
+
+class SectionedStatsPublisher:
+    """
+    Publishes each dashboard section to `<base_topic>/<section>` as a retained message and
+    skips sections whose content hash did not change since the last publish.
+
+    Sections listed in `delta_sections` (flat maps such as userClusters) are published as
+    {"seq", "data"} snapshots on the section topic, and changes in between go out as retained
+    {"seq", "base", "set", "removed"} deltas on `<base_topic>/<section>/delta`. Each delta is
+    cumulative since the snapshot with seq `base`, so a subscriber connecting at any time gets
+    the snapshot plus one delta that brings it up to date. A fresh retained snapshot is sent
+    every `snapshot_every` deltas or when the delta would be larger than half of the map.
+    Consumers apply deltas whose seq is greater than the one they hold and whose base is not
+    newer than their snapshot.
+    """
+
+    def __init__(self, mqtt_pub, base_topic=TOPIC_EV, delta_sections=(), snapshot_every=50, publish_combined=False):
+        self.mqtt_pub = mqtt_pub
+        self.base_topic = base_topic
+        self.delta_sections = set(delta_sections)
+        self.snapshot_every = max(1, snapshot_every)
+        self.publish_combined = publish_combined
+        self._hashes = {}
+        self._maps = {}
+        self._seq = {}
+        self._snapshot_seq = {}
+        self._touched = {}
+        self._deltas_since_snapshot = {}
+
+    def publish(self, totalStats):
+        changed = []
+        for section, content in totalStats.items():
+            payload = _encode(content)
+            digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+            if self._hashes.get(section) == digest:
+                continue
+
+            if section in self.delta_sections and isinstance(content, dict):
+                self._publish_map(section, content)
+            else:
+                self.mqtt_pub.publish(payload, topic=f"{self.base_topic}/{section}", retain=True, qos=1)
+            self._hashes[section] = digest
+            changed.append(section)
+
+        if self.publish_combined and changed:
+            self.mqtt_pub.publish(json.dumps(totalStats), topic=self.base_topic)
+        return changed
+
+    def _publish_map(self, section, content):
+        # Keys are compared in their JSON form so they match what consumers see
+        current = json.loads(_encode(content))
+        previous = self._maps.get(section)
+        seq = self._seq.get(section, 0) + 1
+        self._seq[section] = seq
+        topic = f"{self.base_topic}/{section}"
+
+        if previous is not None and self._deltas_since_snapshot.get(section, 0) < self.snapshot_every:
+            # Every key touched since the snapshot, with its current value: applies to any state from base on
+            touched = self._touched[section]
+            touched.update(k for k, v in current.items() if previous.get(k, object()) != v)
+            touched.update(k for k in previous if k not in current)
+            if len(touched) * 2 <= len(current):
+                delta = {
+                    "seq": seq,
+                    "base": self._snapshot_seq[section],
+                    "set": {k: current[k] for k in touched if k in current},
+                    "removed": [k for k in touched if k not in current]
+                }
+                self.mqtt_pub.publish(_encode(delta), topic=f"{topic}/delta", retain=True, qos=1)
+                self._maps[section] = current
+                self._deltas_since_snapshot[section] = self._deltas_since_snapshot.get(section, 0) + 1
+                return
+
+        self.mqtt_pub.publish(_encode({"seq": seq, "data": current}), topic=topic, retain=True, qos=1)
+        if previous is not None:
+            # The retained delta belongs to the previous snapshot: an empty retained payload clears it
+            self.mqtt_pub.publish("", topic=f"{topic}/delta", retain=True, qos=1)
+        self._maps[section] = current
+        self._touched[section] = set()
+        self._snapshot_seq[section] = seq
+        self._deltas_since_snapshot[section] = 0
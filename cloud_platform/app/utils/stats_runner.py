@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+import time
+
+from utils import db as DB
+from utils import stats as StatsDB
+
+# Dashboard section -> stats query; the queries are independent and can run side by side
+DASHBOARD_QUERIES = {
+    "trendsStats": StatsDB.get_daily_weekly_monthly_trends,
+    "todDistribution": StatsDB.get_time_of_day_distribution,
+    "userPatterns": StatsDB.get_user_behavior_patterns,
+    "clusterProfiles": StatsDB.analyze_cluster_profiles,
+    "userClusters": StatsDB.get_user_clusters,
+}
+
+
+def _failed(result):
+    # stats.py reports query errors in-band instead of raising
+    if isinstance(result, dict):
+        return result.get("success") is False or set(result) == {"error"}
+    return False
+
+
+class StatsRunner:
+    """
+    Runs the dashboard stats queries concurrently, each on its own pooled connection.
+    Every query gets `timeout_s` (enforced server-side with statement_timeout as well);
+    sections that fail or time out are left out of the result instead of failing the refresh.
+    """
+
+    def __init__(self, max_workers=5, timeout_s=30.0, queries=None):
+        self.queries = dict(queries or DASHBOARD_QUERIES)
+        self.timeout_s = timeout_s
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stats")
+
+    def _run_query(self, fn):
+        with DB.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(self.timeout_s * 1000),))
+            return DB.make_json_safe(fn(conn))
+
+    def run(self):
+        started = time.monotonic()
+        futures = {name: self._executor.submit(self._run_query, fn) for name, fn in self.queries.items()}
+
+        results = {}
+        failures = {}
+        for name, future in futures.items():
+            # All queries started together, so each one's deadline is measured from the start
+            remaining = max(0.0, started + self.timeout_s - time.monotonic())
+            try:
+                result = future.result(timeout=remaining)
+            except FutureTimeout:
+                future.cancel()
+                failures[name] = f"timed out after {self.timeout_s}s"
+                continue
+            except Exception as e:
+                failures[name] = str(e)
+                continue
+
+            if _failed(result):
+                failures[name] = result.get("error")
+            else:
+                results[name] = result
+
+        for name, error in failures.items():
+            print(f"Stats section {name} failed: {error}", flush=True)
+        print(f"Stats refreshed in {time.monotonic() - started:.2f}s ({len(results)}/{len(futures)} sections)", flush=True)
+        return results, failures
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
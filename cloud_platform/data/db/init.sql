@@ -20,16 +20,16 @@ CREATE TABLE IF NOT EXISTS ev_session (
     station_id TEXT REFERENCES ev_station(station_id),
     start_time TIMESTAMP,
     end_time TIMESTAMP,
-    energy_consumed_kwh NUMERIC(12,8),
-    duration_h NUMERIC(12,8),
-    charging_rate_kw NUMERIC(12,8),
-    charging_cost_eur NUMERIC(12,8),
+    energy_consumed_kwh DOUBLE PRECISION,
+    duration_h DOUBLE PRECISION,
+    charging_rate_kw DOUBLE PRECISION,
+    charging_cost_eur DOUBLE PRECISION,
     time_of_day TEXT,
     day_of_week TEXT,
-    soc_start NUMERIC(12,8),
-    soc_end NUMERIC(12,8),
-    distance_driven_km NUMERIC(12,8),
-    temperature_c NUMERIC(12,8),
+    soc_start DOUBLE PRECISION,
+    soc_end DOUBLE PRECISION,
+    distance_driven_km DOUBLE PRECISION,
+    temperature_c DOUBLE PRECISION,
     vehicle_age_years INTEGER
 );
 
@@ -45,4 +45,16 @@ ADD COLUMN IF NOT EXISTS clustering_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAM
 
 CREATE INDEX IF NOT EXISTS idx_ev_session_cluster_kmeans ON ev_session(cluster_kmeans);
 CREATE INDEX IF NOT EXISTS idx_ev_session_cluster_dbscan ON ev_session(cluster_dbscan);
-CREATE INDEX IF NOT EXISTS idx_ev_session_user_cluster ON ev_session(user_id, cluster_kmeans);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_ev_session_user_cluster ON ev_session(user_id, cluster_kmeans);
+
+
+-- Resumo diário usado pelas tendências diárias/semanais/mensais (mantido pela app)
+CREATE TABLE IF NOT EXISTS ev_session_daily (
+    day DATE PRIMARY KEY,
+    session_count INTEGER NOT NULL,
+    energy_sum DOUBLE PRECISION,
+    energy_count INTEGER NOT NULL,
+    duration_sum DOUBLE PRECISION,
+    duration_count INTEGER NOT NULL,
+    cost_sum DOUBLE PRECISION
+);
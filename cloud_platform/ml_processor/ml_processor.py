@@ -1,24 +1,98 @@
 from flask import Flask, request, jsonify # type: ignore
-from sklearn.cluster import KMeans, DBSCAN # type: ignore
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN # type: ignore
 from sklearn.ensemble import IsolationForest # type: ignore
 from sklearn.preprocessing import StandardScaler # type: ignore
+from sklearn.neighbors import KDTree # type: ignore
+from threadpoolctl import threadpool_limits # type: ignore
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime
 from waitress import serve # type: ignore
 import pandas as pd
 import numpy as np
 import joblib # type: ignore
+import msgpack # type: ignore
+import psycopg2 # type: ignore
+import multiprocessing
+import threading
+import shutil
+import fcntl
+import queue
+import uuid
+import copy
 import json
+import time
 import os
 
 app = Flask(__name__)
 
 MODEL_DIR = "models"
+# Each training run (or saved batch of online updates) writes models/versions/<version>/;
+# CURRENT holds the active version and is replaced atomically, so activating any version is a rollback
+MODEL_VERSIONS_DIR = os.path.join(MODEL_DIR, "versions")
+CURRENT_FILE = os.path.join(MODEL_DIR, "CURRENT")
+MODEL_FILENAME = "session_models.pkl"
+# Next to the pickle (kept for online updates), each version has a lean serving artifact: only the
+# arrays inference needs, as .npy files memory-mapped on load and shared by every process reading them
+SERVING_DIRNAME = "serving"
+SERVING_MANIFEST = "manifest.json"
+# Single-file artifact of the old layout, adopted as a version on startup
+LEGACY_MODEL_FILE = os.path.join(MODEL_DIR, MODEL_FILENAME)
+# Trained versions and online-update snapshots are pruned separately, so frequent online saves
+# never push the trained versions (the rollback targets) out
+MODEL_KEEP_VERSIONS = int(os.environ.get("MODEL_KEEP_VERSIONS", "20"))
+MODEL_KEEP_ONLINE_VERSIONS = int(os.environ.get("MODEL_KEEP_ONLINE_VERSIONS", "10"))
+
+# Training jobs run one at a time in their own process with capped BLAS/OpenMP threads,
+# leaving the other cores to the processes serving predictions
+TRAIN_THREADS = int(os.environ.get("TRAIN_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+TRAIN_JOB_HISTORY = 100
+
+# Waitress threads only parse requests and answer small batches; batches of at least POOL_PREDICT_MIN_ROWS
+# are split across PREDICT_WORKERS processes (0 = predict everything in the server process)
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", "8"))
+PREDICT_WORKERS = int(os.environ.get("PREDICT_WORKERS", str(min(4, (os.cpu_count() or 1) - 1))))
+POOL_PREDICT_MIN_ROWS = int(os.environ.get("POOL_PREDICT_MIN_ROWS", "20000"))
 
 SESSION_CLUSTERS = 4         
 DBSCAN_EPS = 0.5
 DBSCAN_MIN_SAMPLES = 10
 IFOREST_CONTAM = 0.0001      
 
+# Rows featurized and predicted together by /predict_all_sessions, bounds peak memory on large batches
+PREDICT_CHUNK_SIZE = int(os.environ.get("PREDICT_CHUNK_SIZE", "50000"))
+
+# Online updates (/partial_fit) change the in-memory models; they are written to disk at most this often
+ONLINE_PERSIST_INTERVAL_S = float(os.environ.get("ONLINE_PERSIST_INTERVAL_S", "300"))
+# Between saves the DBSCAN KD-tree keeps the scaling it was built with; it is only rebuilt early once
+# any feature's scaler mean or scale has moved by more than this fraction of that scale
+ONLINE_REINDEX_SHIFT = float(os.environ.get("ONLINE_REINDEX_SHIFT", "0.05"))
+
+# Binary transport: msgpack bodies whose session batches are columnar typed arrays,
+# text dictionary-encoded as "cat" (see app utils/ml_transport.py)
+MSGPACK_MIME = "application/x-msgpack"
+COLUMNAR_FORMAT = "columnar/v1"
+WIRE_DTYPES = {"i8": "<i8", "f8": "<f8", "ts": "<f8"}
+
+# Direct training: /train with a "query" spec streams ev_session from Postgres instead of receiving it
+DB_HOST = os.environ.get("DB_HOST", "db")
+DB_NAME = os.environ.get("DB_NAME", "mydatabase")
+DB_USER = os.environ.get("DB_USER", "user")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "password")
+
+# Rows per fetchmany on the server-side cursor, and rows kept (reservoir sample) to fit the cluster models
+TRAIN_FETCH_SIZE = int(os.environ.get("TRAIN_FETCH_SIZE", "20000"))
+TRAIN_SAMPLE_SIZE = int(os.environ.get("TRAIN_SAMPLE_SIZE", "200000"))
+
+# ev_session columns in list schema order
+TRAIN_QUERY_COLUMNS = [
+    "id", "user_id", "vehicle_model", "battery_capacity_kwh", "station_id",
+    "start_time", "end_time", "energy_consumed_kwh", "duration_h",
+    "charging_rate_kw", "charging_cost_eur", "time_of_day", "day_of_week",
+    "soc_start", "soc_end", "distance_driven_km", "temperature_c", "vehicle_age_years"
+]
+
 LIST_SCHEMA = [
     "idx",
     "User ID",
@@ -55,66 +129,6 @@ def row_from_raw(raw):
             return {}
     return {}
 
-def safe_float(v):
-    try:
-        return float(v)
-    except:
-        return np.nan
-
-def parse_datetime(v):
-    try:
-        return pd.to_datetime(v)
-    except:
-        return None
-
-def featurize_session(r):
-    start = parse_datetime(r.get("Charging Start Time"))
-    end   = parse_datetime(r.get("Charging End Time"))
-
-    battery_kwh = safe_float(r.get("Battery Capacity (kWh)"))
-    energy = safe_float(r.get("Energy Consumed (kWh)"))
-    duration_h = safe_float(r.get("Charging Duration (hours)"))
-    rate_kw = safe_float(r.get("Charging Rate (kW)"))
-    cost = safe_float(r.get("Charging Cost (EUR)"))
-    soc_s = safe_float(r.get("State of Charge (Start %)") )
-    soc_e = safe_float(r.get("State of Charge (End %)") )
-    dist = safe_float(r.get("Distance Driven (since last charge) (km)") )
-    temp = safe_float(r.get("Temperature (C)") )
-    age  = safe_float(r.get("Vehicle Age (years)") )
-
-    soc_delta = np.nan
-    if not np.isnan(soc_s) and not np.isnan(soc_e):
-        soc_delta = soc_e - soc_s
-
-    energy_rel = np.nan
-    if battery_kwh and battery_kwh > 0 and not np.isnan(energy):
-        energy_rel = energy / battery_kwh
-
-    hour = start.hour if start is not None else np.nan
-
-    intensity = np.nan
-    if duration_h and duration_h > 0 and not np.isnan(energy):
-        intensity = energy / duration_h
-
-    if np.isnan(dist):
-        dist = 0.0
-
-    return {
-        "energy_kwh": energy,
-        "duration_h": duration_h,
-        "rate_kw": rate_kw,
-        "cost_eur": cost,
-        "soc_start": soc_s,
-        "soc_end": soc_e,
-        "soc_delta": soc_delta,
-        "distance_km": dist,
-        "temp_c": temp,
-        "vehicle_age": age,
-        "hour": hour,
-        "energy_rel": energy_rel,
-        "intensity": intensity
-    }
-
 SESSION_NUM_COLS = [
     "energy_kwh",
     "duration_h",
@@ -131,78 +145,752 @@ SESSION_NUM_COLS = [
     "intensity",
 ]
 
+def _frame_from_columnar(block):
+    # Columns arrive in list schema order; extra trailing columns are ignored and missing ones are NaN
+    data = {}
+    for name, column in zip(LIST_SCHEMA, block["columns"]):
+        kind = column["type"]
+        if kind == "cat":
+            codes = np.frombuffer(column["data"]["codes"], dtype=f"<i{column['data']['width']}")
+            values = pd.Categorical.from_codes(codes, categories=column["data"]["values"])
+        elif kind in WIRE_DTYPES:
+            values = np.frombuffer(column["data"], dtype=WIRE_DTYPES[kind])
+            if kind == "ts":
+                values = pd.to_datetime(values, unit="s")
+        else:
+            values = column["data"]
+        data[name] = values
+    return pd.DataFrame(data).reindex(columns=LIST_SCHEMA)
+
+def _frame_from_raw(raw_rows):
+    if isinstance(raw_rows, pd.DataFrame):
+        return raw_rows
+    rows = raw_rows if isinstance(raw_rows, list) else list(raw_rows)
+    if rows and all(isinstance(r, (list, tuple)) for r in rows):
+        # List schema: positional columns, extra trailing columns are ignored and missing ones are NaN
+        df = pd.DataFrame.from_records(rows)
+        df = df.reindex(columns=range(len(LIST_SCHEMA)))
+        df.columns = LIST_SCHEMA
+        return df
+    return pd.DataFrame([row_from_raw(r) for r in rows], columns=LIST_SCHEMA)
+
+def _numeric_col(df, name):
+    return pd.to_numeric(df[name], errors="coerce").astype(float)
+
+def _start_hours(values):
+    # Each row parsed on its own layout (naive, ISO with T / fractional seconds...), not the first row's
+    try:
+        start = pd.to_datetime(values, errors="coerce", format="mixed")
+        if pd.api.types.is_datetime64_any_dtype(start):
+            return start.dt.hour.astype(float)
+    except (ValueError, TypeError):
+        pass
+    # Naive and offset-aware timestamps in one batch: row by row, keeping each row's wall-clock hour
+    hours = [getattr(pd.to_datetime(v, errors="coerce"), "hour", np.nan) for v in values]
+    return pd.Series(hours, index=values.index, dtype=float)
+
+def featurize_sessions(raw_rows):
+    df = _frame_from_raw(raw_rows)
+
+    battery_kwh = _numeric_col(df, "Battery Capacity (kWh)")
+    energy = _numeric_col(df, "Energy Consumed (kWh)")
+    duration_h = _numeric_col(df, "Charging Duration (hours)")
+    soc_s = _numeric_col(df, "State of Charge (Start %)")
+    soc_e = _numeric_col(df, "State of Charge (End %)")
+
+    feats = pd.DataFrame({
+        "energy_kwh": energy,
+        "duration_h": duration_h,
+        "rate_kw": _numeric_col(df, "Charging Rate (kW)"),
+        "cost_eur": _numeric_col(df, "Charging Cost (EUR)"),
+        "soc_start": soc_s,
+        "soc_end": soc_e,
+        "soc_delta": soc_e - soc_s,
+        "distance_km": _numeric_col(df, "Distance Driven (since last charge) (km)").fillna(0.0),
+        "temp_c": _numeric_col(df, "Temperature (C)"),
+        "vehicle_age": _numeric_col(df, "Vehicle Age (years)"),
+        "hour": _start_hours(df["Charging Start Time"]),
+        "energy_rel": (energy / battery_kwh).where((battery_kwh > 0) & energy.notna()),
+        "intensity": (energy / duration_h).where((duration_h > 0) & energy.notna()),
+    })
+    return feats[SESSION_NUM_COLS]
+
+def featurize_session(r):
+    return featurize_sessions([r]).iloc[0].to_dict()
+
 def train_models(raw_rows):
-    feat_rows = [featurize_session(row_from_raw(r)) for r in raw_rows]
-    df = pd.DataFrame(feat_rows).fillna(0)
+    df = featurize_sessions(raw_rows).fillna(0)
 
     scaler = StandardScaler()
     X = scaler.fit_transform(df.values)
 
+    return _fit_and_save(scaler, X, {"n_sessions": len(df)})
+
+def _fit_and_save(scaler, X, meta):
     kmeans = KMeans(n_clusters=SESSION_CLUSTERS, random_state=42, n_init=20)
     kmeans.fit(X)
 
     dbscan = DBSCAN(eps=DBSCAN_EPS, min_samples=DBSCAN_MIN_SAMPLES)
     dbscan.fit(X)
+    core_samples = dbscan.components_
+    core_labels = dbscan.labels_[dbscan.core_sample_indices_]
 
     iso = IsolationForest(contamination=IFOREST_CONTAM, random_state=42)
     iso.fit(X)
 
-    joblib.dump({
+    # Sessions behind each center, so online updates move the centers as a running mean over all of them
+    counts = np.bincount(kmeans.labels_, minlength=SESSION_CLUSTERS) * (meta["n_sessions"] / len(X))
+
+    meta = dict(meta, n_features=len(SESSION_NUM_COLS), kmeans_clusters=SESSION_CLUSTERS, source="train")
+
+    bundle = {
         "scaler": scaler,
         "kmeans": kmeans,
-        "dbscan": dbscan,
+        "kmeans_counts": counts,
+        "dbscan_core_samples": core_samples,
+        "dbscan_core_labels": core_labels,
+        "dbscan_eps": DBSCAN_EPS,
         "isolation": iso,
-        "columns": SESSION_NUM_COLS
-    }, os.path.join(MODEL_DIR, "session_models.pkl"))
-
-    meta = {
-        "n_sessions": len(df),
-        "n_features": len(SESSION_NUM_COLS),
-        "kmeans_clusters": SESSION_CLUSTERS
+        "columns": SESSION_NUM_COLS,
+        "meta": meta
     }
-
-    with open(os.path.join(MODEL_DIR, "meta.json"), "w") as f:
-        json.dump(meta, f)
-
+    with _update_lock:
+        return _save_models(bundle)
+
+def _version_dir(version):
+    return os.path.join(MODEL_VERSIONS_DIR, version)
+
+def _new_version(now=None):
+    return (now or datetime.now()).strftime("%Y%m%d-%H%M%S-%f")
+
+def list_versions():
+    if not os.path.isdir(MODEL_VERSIONS_DIR):
+        return []
+    return sorted(v for v in os.listdir(MODEL_VERSIONS_DIR) if not v.endswith(".tmp"))
+
+def _current_version():
+    with open(CURRENT_FILE) as f:
+        return f.read().strip()
+
+def _activate_version(version):
+    tmp_path = CURRENT_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, CURRENT_FILE)
+
+@contextmanager
+def _versions_lock():
+    # Versions are saved by the server (online updates, activation) and by the training process
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    with open(os.path.join(MODEL_DIR, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _save_models(bundle, base_version=None):
+    """
+    Writes a new version and makes it the active one. With base_version, nothing is saved
+    (returns None) if another version became active since the bundle was loaded.
+    """
+    with _versions_lock():
+        previous = _current_version() if os.path.exists(CURRENT_FILE) else None
+        if base_version is not None and previous != base_version:
+            return None
+
+        # The version directory is complete (renamed from .tmp) before CURRENT points at it
+        version = _new_version()
+        meta = dict(bundle["meta"], version=version, previous=previous, created_at=datetime.now().isoformat(timespec="seconds"))
+        bundle = dict(_reindexed(bundle), meta=meta)
+
+        tmp_dir = _version_dir(version) + ".tmp"
+        os.makedirs(tmp_dir)
+        joblib.dump(bundle, os.path.join(tmp_dir, MODEL_FILENAME))
+        _write_serving_artifact(bundle, os.path.join(tmp_dir, SERVING_DIRNAME))
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_dir, _version_dir(version))
+
+        _activate_version(version)
+        _prune_versions(version)
+
+    _full_cache.update(version=version, bundle=bundle)
+    _cache_models(_load_serving(version), version)
+    _online_state["pending"] = 0
     return meta
 
-def predict_session(raw):
-    d = row_from_raw(raw)
-    f = featurize_session(d)
-
-    trainning_results = joblib.load(os.path.join(MODEL_DIR, "session_models.pkl"))
-    scaler = trainning_results["scaler"]
-    kmeans = trainning_results["kmeans"]
-    dbscan = trainning_results["dbscan"]
-    iso = trainning_results["isolation"]
-    cols = trainning_results["columns"]
-
-    for col in cols:
-        if col not in f:
-            f[col] = 0
-
-    row_vector = np.array([[f.get(c, 0) for c in cols]])
-    X = scaler.transform(row_vector)
-
-    km = int(kmeans.predict(X)[0])
-    db = int(dbscan.fit_predict(X)[0])
-
+def _dbscan_core(bundle):
+    # Bundles pickled before the core-sample assignment (adopted legacy artifacts) have no core samples:
+    # with empty arrays every session is DBSCAN noise (-1), as those versions always predicted
+    core_samples = bundle.get("dbscan_core_samples")
+    if core_samples is None:
+        return np.empty((0, len(bundle["columns"]))), np.empty(0, dtype=int)
+    return core_samples, bundle["dbscan_core_labels"]
+
+def _reindexed(bundle):
+    # Core samples still in the scaling of an earlier online update, remapped to the bundle's scaler
+    core_scaler = bundle.get("dbscan_scaler")
+    if core_scaler is None:
+        return bundle
+    core_samples, core_labels = _dbscan_core(bundle)
+    bundle = {k: v for k, v in bundle.items() if k != "dbscan_scaler"}
+    bundle["dbscan_core_samples"] = _rescale(core_samples, core_scaler, bundle["scaler"])
+    bundle["dbscan_core_labels"] = core_labels
+    return bundle
+
+def _serving_arrays(bundle):
+    scaler = bundle["scaler"]
+    core_samples, core_labels = _dbscan_core(bundle)
+    arrays = {
+        "scaler_mean": scaler.mean_,
+        "scaler_scale": scaler.scale_,
+        "kmeans_centers": bundle["kmeans"].cluster_centers_,
+        "dbscan_core_samples": core_samples,
+        "dbscan_core_labels": core_labels
+    }
+    core_scaler = bundle.get("dbscan_scaler")
+    if core_scaler is not None:
+        # Only in memory, never written: saved bundles are reindexed first
+        arrays.update(dbscan_core_mean=core_scaler.mean_, dbscan_core_scale=core_scaler.scale_)
+    return arrays
+
+def _isolation_arrays(iso):
+    # Trees flattened into one array per node attribute; tree t owns nodes node_offsets[t]:node_offsets[t + 1]
+    trees = [estimator.tree_ for estimator in iso.estimators_]
     return {
-        "cluster_kmeans": km,
-        "cluster_dbscan": db
+        "iforest_node_offsets": np.cumsum([0] + [tree.node_count for tree in trees]),
+        "iforest_children_left": np.concatenate([tree.children_left for tree in trees]),
+        "iforest_children_right": np.concatenate([tree.children_right for tree in trees]),
+        "iforest_feature": np.concatenate([tree.feature for tree in trees]),
+        "iforest_threshold": np.concatenate([tree.threshold for tree in trees]),
+        "iforest_n_node_samples": np.concatenate([tree.n_node_samples for tree in trees]),
+        "iforest_estimator_features": np.array(iso.estimators_features_)
+    }
+
+def _write_serving_artifact(bundle, directory):
+    arrays = _serving_arrays(bundle)
+    manifest = {"columns": bundle["columns"], "dbscan_eps": bundle.get("dbscan_eps", DBSCAN_EPS)}
+    iso = bundle.get("isolation")
+    if iso is not None:
+        arrays.update(_isolation_arrays(iso))
+        manifest.update(iforest_offset=float(iso.offset_), iforest_max_samples=int(iso.max_samples_))
+
+    os.makedirs(directory)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, name + ".npy"), np.ascontiguousarray(values))
+    manifest["arrays"] = list(arrays)
+    with open(os.path.join(directory, SERVING_MANIFEST), "w") as f:
+        json.dump(manifest, f)
+
+def _serving_models(arrays, columns, eps, meta):
+    # KD-tree over the core samples is the only structure rebuilt on load
+    core_samples = arrays["dbscan_core_samples"]
+    return dict(
+        arrays,
+        dbscan_index=KDTree(core_samples) if len(core_samples) else None,
+        dbscan_eps=eps,
+        columns=columns,
+        meta=meta
+    )
+
+def _serving_from_bundle(bundle):
+    return _serving_models(_serving_arrays(bundle), bundle["columns"], bundle.get("dbscan_eps", DBSCAN_EPS), bundle.get("meta", {}))
+
+def _load_serving(version):
+    directory = os.path.join(_version_dir(version), SERVING_DIRNAME)
+    if not os.path.exists(os.path.join(directory, SERVING_MANIFEST)):
+        # Versions saved before the serving artifact existed
+        return _serving_from_bundle(joblib.load(os.path.join(_version_dir(version), MODEL_FILENAME)))
+
+    with open(os.path.join(directory, SERVING_MANIFEST)) as f:
+        manifest = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+        for name in manifest["arrays"]
+    }
+    return _serving_models(arrays, manifest["columns"], manifest["dbscan_eps"], _version_meta(version))
+
+def _prune_versions(active):
+    trained, online = [], []
+    for version in list_versions():
+        (online if _version_meta(version).get("source") == "online" else trained).append(version)
+    for versions, keep in ((trained, MODEL_KEEP_VERSIONS), (online, MODEL_KEEP_ONLINE_VERSIONS)):
+        if keep <= 0:
+            continue
+        for version in versions[:-keep]:
+            if version != active:
+                shutil.rmtree(_version_dir(version), ignore_errors=True)
+
+def _version_meta(version):
+    try:
+        with open(os.path.join(_version_dir(version), "meta.json")) as f:
+            return dict(json.load(f), version=version)
+    except (OSError, ValueError):
+        return {"version": version}
+
+def adopt_legacy_artifact():
+    if os.path.exists(CURRENT_FILE) or not os.path.exists(LEGACY_MODEL_FILE):
+        return
+    version = _new_version(datetime.fromtimestamp(os.path.getmtime(LEGACY_MODEL_FILE))) + "-legacy"
+    os.makedirs(_version_dir(version))
+    os.replace(LEGACY_MODEL_FILE, os.path.join(_version_dir(version), MODEL_FILENAME))
+    legacy_meta = os.path.join(MODEL_DIR, "meta.json")
+    if os.path.exists(legacy_meta):
+        os.replace(legacy_meta, os.path.join(_version_dir(version), "meta.json"))
+    _activate_version(version)
+    print(f"Adopted legacy model artifact as version {version}", flush=True)
+
+def _session_query(spec):
+    # spec: {"start": ts, "end": ts, "sample_rate": 0-1, "seed": int}, every field optional
+    sql = f"SELECT {', '.join(TRAIN_QUERY_COLUMNS)} FROM ev_session"
+    params = []
+    sample_rate = float(spec.get("sample_rate", 1))
+    if not 0 < sample_rate <= 1:
+        raise ValueError("sample_rate must be in (0, 1]")
+    if sample_rate < 1:
+        sql += " TABLESAMPLE BERNOULLI (%s) REPEATABLE (%s)"
+        params += [sample_rate * 100, int(spec.get("seed", 42))]
+
+    clauses = []
+    if spec.get("start"):
+        clauses.append("start_time >= %s")
+        params.append(spec["start"])
+    if spec.get("end"):
+        clauses.append("start_time < %s")
+        params.append(spec["end"])
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, params
+
+def _iter_session_chunks(spec, fetch_size):
+    sql, params = _session_query(spec)
+    conn = psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+    try:
+        conn.set_session(readonly=True)
+        # Named cursor: rows stay on the server and arrive fetch_size at a time
+        cursor = conn.cursor(name="ml_train_sessions")
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield _frame_from_raw(rows)
+        cursor.close()
+    finally:
+        conn.close()
+
+def _reservoir_add(sample, seen, X, rng):
+    # Algorithm R over a chunk: each of the `seen` streamed rows stays in the sample with probability len(sample) / seen
+    capacity = len(sample)
+    fill = min(max(capacity - seen, 0), len(X))
+    sample[seen:seen + fill] = X[:fill]
+    rest = X[fill:]
+    if len(rest):
+        positions = rng.integers(0, np.arange(seen + fill, seen + len(X)) + 1)
+        keep = positions < capacity
+        sample[positions[keep]] = rest[keep]
+    return seen + len(X)
+
+def train_models_from_db(spec):
+    """
+    Streams ev_session in chunks: the scaler is fitted incrementally on every row,
+    the cluster models on a uniform sample of at most `max_sample` rows.
+    """
+    sample_size = int(spec.get("max_sample") or TRAIN_SAMPLE_SIZE)
+    rng = np.random.default_rng(int(spec.get("seed", 42)))
+    scaler = StandardScaler()
+    sample = np.empty((sample_size, len(SESSION_NUM_COLS)))
+    seen = 0
+
+    for chunk in _iter_session_chunks(spec, TRAIN_FETCH_SIZE):
+        X = featurize_sessions(chunk).fillna(0).values
+        scaler.partial_fit(X)
+        seen = _reservoir_add(sample, seen, X, rng)
+
+    if seen == 0:
+        raise ValueError("no sessions match the training query")
+
+    X = scaler.transform(sample[:min(seen, sample_size)])
+    return _fit_and_save(scaler, X, {"n_sessions": seen, "n_sampled": len(X)})
+
+_model_lock = threading.Lock()
+_model_cache = {"stamp": None, "bundle": None}
+# Full (pickled) bundle of a version, only loaded for online updates
+_full_cache = {"version": None, "bundle": None}
+
+# Serializes model swaps (full trains, online updates); predictions keep reading whichever bundle is cached
+_update_lock = threading.Lock()
+_online_state = {"pending": 0}
+
+def _cache_models(bundle, stamp):
+    global _model_cache
+    _model_cache = {"stamp": stamp, "bundle": bundle}
+
+def load_models():
+    # Serving arrays of the active version stay resident and are only reloaded when CURRENT points to another version
+    version = _current_version()
+    cache = _model_cache
+    if cache["stamp"] == version:
+        return cache["bundle"]
+
+    with _model_lock:
+        if _model_cache["stamp"] != version:
+            print(f"Loading session models {version}", flush=True)
+            _cache_models(_load_serving(version), version)
+        return _model_cache["bundle"]
+
+def _load_full_models():
+    version = _current_version()
+    if _full_cache["version"] != version:
+        _full_cache.update(version=version, bundle=joblib.load(os.path.join(_version_dir(version), MODEL_FILENAME)))
+    return _full_cache["bundle"]
+
+def activate_version(version):
+    if version not in list_versions():
+        raise KeyError(version)
+    with _update_lock, _versions_lock():
+        _activate_version(version)
+        # Online updates not yet saved belonged to the version being replaced
+        _online_state["pending"] = 0
+    # Loaded right away so the next prediction already runs on the activated version
+    return load_models().get("meta") or _version_meta(version)
+
+def _rescale(X, old_scaler, new_scaler):
+    # Points fitted in the old scaled space, expressed in the new one (same raw values)
+    return (X * old_scaler.scale_ + old_scaler.mean_ - new_scaler.mean_) / new_scaler.scale_
+
+def _scaler_shift(old_scaler, new_scaler):
+    # Largest move of any feature's mean or scale, relative to the old scale
+    return max(
+        float(np.max(np.abs(new_scaler.mean_ - old_scaler.mean_) / old_scaler.scale_)),
+        float(np.max(np.abs(new_scaler.scale_ / old_scaler.scale_ - 1)))
+    )
+
+def _unsaved_meta(meta):
+    # Models with online updates not yet saved have no version (nor creation time) of their own
+    return {k: v for k, v in meta.items() if k not in ("version", "previous", "created_at")}
+
+def _online_kmeans(bundle):
+    kmeans = bundle["kmeans"]
+    if isinstance(kmeans, MiniBatchKMeans):
+        return copy.deepcopy(kmeans)
+    # First online update: a MiniBatchKMeans starting exactly at the trained centers,
+    # each center weighted by the sessions it already holds
+    centers = kmeans.cluster_centers_
+    online = MiniBatchKMeans(
+        n_clusters=len(centers), init=centers, n_init=1,
+        reassignment_ratio=0.0, random_state=42
+    )
+    counts = bundle.get("kmeans_counts")
+    if counts is None:
+        counts = np.bincount(kmeans.labels_, minlength=len(centers))
+    online.partial_fit(centers, sample_weight=np.maximum(counts, 1).astype(float))
+    return online
+
+def partial_fit_models(raw_rows):
+    """
+    Folds new sessions into the current models: the scaler's running mean/variance and
+    the KMeans centers (MiniBatchKMeans.partial_fit) are updated and the centers remapped
+    to the new scaling. DBSCAN core samples and their KD-tree keep their scaling until the
+    updates are saved or the scaler shifts past ONLINE_REINDEX_SHIFT. DBSCAN clusters and
+    the IsolationForest only change on a full /train. Returns the meta of the unsaved
+    models, with the version they build on as "base_version".
+    """
+    with _update_lock:
+        bundle = _load_full_models()
+        feats = featurize_sessions(raw_rows).reindex(columns=bundle["columns"]).fillna(0)
+        if feats.empty:
+            if _online_state["pending"]:
+                return dict(bundle["meta"], base_version=_full_cache["version"])
+            return bundle.get("meta", {})
+
+        old_scaler = bundle["scaler"]
+        scaler = copy.deepcopy(old_scaler)
+        scaler.partial_fit(feats.values)
+
+        kmeans = _online_kmeans(bundle)
+        kmeans.cluster_centers_ = _rescale(kmeans.cluster_centers_, old_scaler, scaler)
+        kmeans.partial_fit(scaler.transform(feats.values))
+
+        meta = _unsaved_meta(bundle.get("meta", {}))
+        meta["source"] = "online"
+        meta["online_updates"] = meta.get("online_updates", 0) + 1
+        meta["online_sessions"] = meta.get("online_sessions", 0) + len(feats)
+
+        core_scaler = bundle.get("dbscan_scaler", old_scaler)
+        bundle = dict(bundle, scaler=scaler, kmeans=kmeans, dbscan_scaler=core_scaler, meta=meta)
+        cached = _model_cache
+        if cached["stamp"] == _full_cache["version"] and _scaler_shift(core_scaler, scaler) <= ONLINE_REINDEX_SHIFT:
+            # The cached KD-tree was built over these same core samples: only the arrays change
+            serving = dict(cached["bundle"], **_serving_arrays(bundle))
+        else:
+            bundle = _reindexed(bundle)
+            serving = _serving_from_bundle(bundle)
+        meta = dict(meta, base_version=_full_cache["version"])
+        serving["meta"] = meta
+        _full_cache["bundle"] = bundle
+        _cache_models(serving, _full_cache["version"])
+        _online_state["pending"] += 1
+        return meta
+
+def persist_online_updates():
+    while True:
+        time.sleep(ONLINE_PERSIST_INTERVAL_S)
+        try:
+            with _update_lock:
+                pending = _online_state["pending"]
+                if pending:
+                    print(f"Saving {pending} online model updates", flush=True)
+                    if _save_models(_full_cache["bundle"], base_version=_full_cache["version"]) is None:
+                        print(f"Dropped {pending} online model updates: a newer version is active", flush=True)
+                        _online_state["pending"] = 0
+        except Exception as e:
+            print("ERROR PERSIST:", e, flush=True)
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_queue = queue.Queue()
+
+def submit_training(train, data):
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "status": "queued",
+        "submitted_at": datetime.now().isoformat(timespec="seconds"),
+        "started_at": None,
+        "finished_at": None,
+        "version": None,
+        "meta": None,
+        "error": None
     }
+    with _jobs_lock:
+        _jobs[job["id"]] = job
+        finished = [j for j, v in _jobs.items() if v["status"] in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(_jobs) - TRAIN_JOB_HISTORY)]:
+            del _jobs[job_id]
+    _job_queue.put((job["id"], train, data))
+    return dict(job)
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+_pools = {"train": None, "predict": None}
+
+def start_worker_pools():
+    # spawn, not fork: the server process already runs threads (waitress, jobs, persistence)
+    context = multiprocessing.get_context("spawn")
+    _pools["train"] = ProcessPoolExecutor(max_workers=1, mp_context=context)
+    if PREDICT_WORKERS > 0:
+        _pools["predict"] = ProcessPoolExecutor(max_workers=PREDICT_WORKERS, mp_context=context)
+        # Workers start (and import this module) now rather than on the first large batch
+        for _ in range(PREDICT_WORKERS):
+            _pools["predict"].submit(os.getpid)
+
+def _run_training(train, data):
+    with threadpool_limits(limits=TRAIN_THREADS):
+        return train(data)
+
+def run_training_jobs():
+    while True:
+        job_id, train, data = _job_queue.get()
+        job = _jobs[job_id]
+        job.update(status="running", started_at=datetime.now().isoformat(timespec="seconds"))
+        try:
+            if _pools["train"] is not None:
+                meta = _pools["train"].submit(_run_training, train, data).result()
+            else:
+                meta = _run_training(train, data)
+            job.update(status="succeeded", version=meta["version"], meta=meta)
+        except BrokenProcessPool as e:
+            # The training process died (e.g. out of memory): the next job gets a fresh one
+            print("ERROR TRAIN: training process died", flush=True)
+            job.update(status="failed", error=f"training process died: {e}")
+            _pools["train"] = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        except Exception as e:
+            print("ERROR TRAIN:", e, flush=True)
+            job.update(status="failed", error=str(e))
+        job["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        data = None
+
+def _session_id(raw):
+    if isinstance(raw, dict):
+        return raw.get("idx")
+    return raw[0]
+
+def _rows_slice(raw_rows, start, stop):
+    if isinstance(raw_rows, pd.DataFrame):
+        return raw_rows.iloc[start:stop]
+    return raw_rows[start:stop]
+
+def _session_ids(chunk):
+    if isinstance(chunk, pd.DataFrame):
+        return chunk["idx"].tolist()
+    return [_session_id(raw) for raw in chunk]
+
+def _assign_dbscan(models, X):
+    # New points join the cluster of their nearest core sample when it lies within eps, otherwise noise
+    labels = np.full(len(X), -1, dtype=int)
+    index = models.get("dbscan_index")
+    if index is None or len(X) == 0:
+        return labels
+
+    dist, nearest = index.query(X, k=1)
+    dist = dist[:, 0]
+    nearest = nearest[:, 0]
+    within = dist <= models["dbscan_eps"]
+    labels[within] = models["dbscan_core_labels"][nearest[within]]
+    return labels
+
+def _assign_kmeans(models, X):
+    # Nearest centroid (squared euclidean), as KMeans.predict
+    centers = models["kmeans_centers"]
+    return ((X[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+def predict_labels(raw_rows, chunk_size=None):
+    """Returns (session ids, kmeans labels, dbscan labels) as lists."""
+    models = load_models()
+    cols = models["columns"]
+    chunk_size = max(1, int(chunk_size or PREDICT_CHUNK_SIZE))
+
+    ids, km_labels, db_labels = [], [], []
+    for start in range(0, len(raw_rows), chunk_size):
+        chunk = _rows_slice(raw_rows, start, start + chunk_size)
+        feats = featurize_sessions(chunk).reindex(columns=cols).fillna(0)
+        X = (feats.values - models["scaler_mean"]) / models["scaler_scale"]
+        if "dbscan_core_mean" in models:
+            # Unsaved online updates: the core samples are still in the scaling their KD-tree was built with
+            X_core = (feats.values - models["dbscan_core_mean"]) / models["dbscan_core_scale"]
+        else:
+            X_core = X
+
+        ids.extend(_session_ids(chunk))
+        km_labels.extend(_assign_kmeans(models, X).tolist())
+        db_labels.extend(_assign_dbscan(models, X_core).tolist())
+    return ids, km_labels, db_labels
+
+def _results_by_session(ids, km_labels, db_labels, results=None):
+    results = {} if results is None else results
+    for session_id, km_label, db_label in zip(ids, km_labels, db_labels):
+        results[session_id] = {
+            "cluster_kmeans": int(km_label),
+            "cluster_dbscan": int(db_label)
+        }
+    return results
+
+def predict_sessions(raw_rows, chunk_size=None):
+    return _results_by_session(*predict_labels(raw_rows, chunk_size))
+
+def predict_sessions_pooled(raw_rows, chunk_size=None):
+    # One slice per worker process; workers map the active version's serving artifact, so this is
+    # only used while no online updates are waiting to be saved (those live in the server process)
+    step = -(-len(raw_rows) // PREDICT_WORKERS)
+    slices = [_rows_slice(raw_rows, start, start + step) for start in range(0, len(raw_rows), step)]
+    results = {}
+    for labels in _pools["predict"].map(predict_labels, slices, [chunk_size] * len(slices)):
+        _results_by_session(*labels, results=results)
+    return results
+
+def predict_session(raw):
+    res = predict_sessions([raw])
+    return next(iter(res.values()))
+
+def _read_payload():
+    # msgpack (columnar sessions) or JSON, chosen by the request Content-Type
+    if request.mimetype == MSGPACK_MIME:
+        payload = msgpack.unpackb(request.get_data(), raw=False)
+    else:
+        payload = request.get_json()
+    if isinstance(payload, dict):
+        sessions = payload.get("ev_sessions")
+        if isinstance(sessions, dict) and sessions.get("format") == COLUMNAR_FORMAT:
+            payload["ev_sessions"] = _frame_from_columnar(sessions)
+    return payload
+
+def _wants_msgpack():
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIME]) == MSGPACK_MIME
+
+def _reply(body, status=200):
+    if _wants_msgpack():
+        return app.response_class(msgpack.packb(body, use_bin_type=True), status=status, mimetype=MSGPACK_MIME)
+    return jsonify(body), status
+
+def _columnar_predictions(results):
+    try:
+        ids = np.array(list(results.keys()), dtype=WIRE_DTYPES["i8"])
+    except (TypeError, ValueError):
+        return results
+    columns = [{"name": "id", "type": "i8", "data": ids.tobytes()}]
+    for name in ("cluster_kmeans", "cluster_dbscan"):
+        values = np.array([r[name] for r in results.values()], dtype=WIRE_DTYPES["i8"])
+        columns.append({"name": name, "type": "i8", "data": values.tobytes()})
+    return {"format": COLUMNAR_FORMAT, "count": len(ids), "columns": columns}
 
 @app.route("/train", methods=["POST"])
 def train_endpoint():
-    payload = request.get_json()
+    payload = _read_payload()
+    if not payload or ("ev_sessions" not in payload and "query" not in payload):
+        return _reply({"error":"expected field 'ev_sessions' or 'query'"}, 400)
+    try:
+        if "ev_sessions" in payload:
+            job = submit_training(train_models, payload["ev_sessions"])
+        else:
+            spec = payload["query"] or {}
+            _session_query(spec)
+            job = submit_training(train_models_from_db, spec)
+        return _reply({"status": "queued", "job_id": job["id"]}, 202)
+    except ValueError as e:
+        print("ERROR TRAIN:", e)
+        return _reply({"status": "error", "error": str(e)}, 400)
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_endpoint(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return _reply({"error": f"unknown job '{job_id}'"}, 404)
+    return _reply(job)
+
+@app.route("/models", methods=["GET"])
+def models_endpoint():
+    active = _current_version() if os.path.exists(CURRENT_FILE) else None
+    versions = [_version_meta(v) for v in list_versions()]
+    return _reply({"active": active, "versions": versions})
+
+@app.route("/models/<version>/activate", methods=["POST"])
+def activate_endpoint(version):
+    try:
+        meta = activate_version(version)
+        return _reply({"status": "ok", "active": version, "meta": meta})
+    except KeyError:
+        return _reply({"error": f"unknown model version '{version}'"}, 404)
+    except Exception as e:
+        print("ERROR ACTIVATE:", e, flush=True)
+        return _reply({"status": "error", "error": str(e)}, 500)
+
+@app.route("/partial_fit", methods=["POST"])
+def partial_fit_endpoint():
+    payload = _read_payload()
     if not payload or "ev_sessions" not in payload:
-        return jsonify({"error":"expected field 'ev_sessions'"}), 400
+        return _reply({"error":"expected field 'ev_sessions'"}, 400)
     try:
-        meta = train_models(payload["ev_sessions"])
-        return jsonify({"status": "ok", "meta": meta})
+        meta = partial_fit_models(payload["ev_sessions"])
+        return _reply({"status": "ok", "meta": meta})
     except Exception as e:
-        print("ERROR TRAIN:", e)
-        return jsonify({"status": "error", "error": str(e)}), 500
+        print("ERROR PARTIAL FIT:", e, flush=True)
+        return _reply({"status": "error", "error": str(e)}, 500)
+
+@app.route("/health", methods=["GET"])
+def health_endpoint():
+    # Liveness only: answered by the server process without loading models or touching the pools
+    with _jobs_lock:
+        statuses = [job["status"] for job in _jobs.values()]
+    return jsonify({
+        "status": "ok",
+        "model_version": _current_version() if os.path.exists(CURRENT_FILE) else None,
+        "jobs_queued": statuses.count("queued"),
+        "jobs_running": statuses.count("running")
+    })
 
 @app.route("/predict_session", methods=["GET"])
 def predict_endpoint():
@@ -218,19 +906,29 @@ def predict_endpoint():
 
 @app.route("/predict_all_sessions", methods=["GET"])
 def predict_all_endpoint():
-    payload = request.get_json()
+    payload = _read_payload()
     if not payload or "ev_sessions" not in payload:
-        return jsonify({"error":"expected field 'ev_sessions'"}), 400
+        return _reply({"error":"expected field 'ev_sessions'"}, 400)
     try:
-        results = {}
-        for raw in payload["ev_sessions"]:
-            res = predict_session(raw)
-            results[raw[0]] = res
-        return jsonify({"status":"ok","results":results})
+        chunk_size = payload.get("chunk_size") or request.args.get("chunk_size", type=int)
+        sessions = payload["ev_sessions"]
+        # Unsaved online updates are only in this process: the workers would predict with the saved version
+        pooled = _pools["predict"] is not None and not _online_state["pending"]
+        if pooled and len(sessions) >= POOL_PREDICT_MIN_ROWS:
+            results = predict_sessions_pooled(sessions, chunk_size)
+        else:
+            results = predict_sessions(sessions, chunk_size)
+        if _wants_msgpack():
+            results = _columnar_predictions(results)
+        return _reply({"status":"ok","results":results})
     except Exception as e:
         print("ERROR PREDICT ALL:", e, flush=True)
-        return jsonify({"status":"error","error":str(e)}), 500
+        return _reply({"status":"error","error":str(e)}, 500)
 
 if __name__ == "__main__":
     print("Starting ML server!")
-    serve(app, host="0.0.0.0", port=5000)
+    adopt_legacy_artifact()
+    start_worker_pools()
+    threading.Thread(target=run_training_jobs, name="train-jobs", daemon=True).start()
+    threading.Thread(target=persist_online_updates, name="online-persist", daemon=True).start()
+    serve(app, host="0.0.0.0", port=5000, threads=SERVE_THREADS)
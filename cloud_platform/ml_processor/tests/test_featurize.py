@@ -0,0 +1,32 @@
+import numpy as np
+
+import ml_processor as ML
+
+
+def _row(start_time):
+    return {
+        "Charging Start Time": start_time,
+        "Energy Consumed (kWh)": 30.0,
+        "Charging Duration (hours)": 2.0,
+        "Battery Capacity (kWh)": 60.0,
+    }
+
+
+def test_mixed_start_time_formats_keep_their_hour():
+    rows = [
+        _row("2024-01-01 10:00:00"),
+        _row("2024-01-02T11:30:00.123456"),
+        _row("2024-01-03T12:00:00"),
+    ]
+    assert ML.featurize_sessions(rows)["hour"].tolist() == [10.0, 11.0, 12.0]
+
+
+def test_naive_and_offset_timestamps_use_wall_clock_hour():
+    rows = [_row("2024-01-01 10:00:00"), _row("2024-01-03T12:00:00+02:00")]
+    assert ML.featurize_sessions(rows)["hour"].tolist() == [10.0, 12.0]
+
+
+def test_unparseable_start_time_is_nan():
+    hours = ML.featurize_sessions([_row("2024-01-01 10:00:00"), _row("not a date"), _row(None)])["hour"]
+    assert hours.iloc[0] == 10.0
+    assert np.isnan(hours.iloc[1]) and np.isnan(hours.iloc[2])
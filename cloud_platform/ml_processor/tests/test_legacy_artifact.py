@@ -0,0 +1,76 @@
+import json
+import os
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN, KMeans
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+import ml_processor as ML
+
+
+def _sessions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        energy = float(rng.uniform(5, 80))
+        duration = float(rng.uniform(0.5, 6))
+        rows.append([
+            i, f"User_{i % 7}", "Tesla Model 3", 75.0, f"ST{i % 5}",
+            f"2024-01-{1 + i % 28:02d} {i % 24:02d}:15:00", None,
+            energy, duration, energy / duration, energy * 0.3, "Morning", "Monday",
+            float(rng.uniform(5, 50)), float(rng.uniform(50, 100)), float(rng.uniform(0, 300)),
+            float(rng.uniform(-5, 35)), float(rng.uniform(0, 10))
+        ])
+    return rows
+
+
+@pytest.fixture
+def legacy_models(tmp_path, monkeypatch):
+    # models/session_models.pkl + meta.json as written before versioning (no core samples, no eps, no meta)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ML, "_model_cache", {"stamp": None, "bundle": None})
+    monkeypatch.setattr(ML, "_full_cache", {"version": None, "bundle": None})
+    monkeypatch.setitem(ML._online_state, "pending", 0)
+
+    scaler = StandardScaler()
+    X = scaler.fit_transform(ML.featurize_sessions(_sessions(200)).fillna(0).values)
+    os.makedirs(ML.MODEL_DIR)
+    joblib.dump({
+        "scaler": scaler,
+        "kmeans": KMeans(n_clusters=ML.SESSION_CLUSTERS, random_state=42, n_init=2).fit(X),
+        "dbscan": DBSCAN(eps=ML.DBSCAN_EPS, min_samples=ML.DBSCAN_MIN_SAMPLES).fit(X),
+        "isolation": IsolationForest(n_estimators=10, random_state=42).fit(X),
+        "columns": ML.SESSION_NUM_COLS
+    }, ML.LEGACY_MODEL_FILE)
+    with open(os.path.join(ML.MODEL_DIR, "meta.json"), "w") as f:
+        json.dump({"n_sessions": 200, "n_features": len(ML.SESSION_NUM_COLS), "kmeans_clusters": ML.SESSION_CLUSTERS}, f)
+
+    ML.adopt_legacy_artifact()
+    return ML.app.test_client()
+
+
+def test_adopted_legacy_bundle_serves_predictions(legacy_models):
+    response = legacy_models.get("/predict_all_sessions", json={"ev_sessions": _sessions(30, seed=1)})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results) == 30
+    assert all(r["cluster_dbscan"] == -1 for r in results.values())
+    assert all(0 <= r["cluster_kmeans"] < ML.SESSION_CLUSTERS for r in results.values())
+
+
+def test_adopted_legacy_bundle_accepts_online_updates(legacy_models):
+    response = legacy_models.post("/partial_fit", json={"ev_sessions": _sessions(20, seed=2)})
+    assert response.status_code == 200
+
+    legacy_version = ML._current_version()
+    meta = ML._save_models(ML._full_cache["bundle"], base_version=legacy_version)
+    assert meta["source"] == "online"
+
+    # The saved version has a serving artifact with empty core samples, still predicting DBSCAN noise
+    ids, km_labels, db_labels = ML.predict_labels(_sessions(10, seed=3))
+    assert ML._current_version() == meta["version"] != legacy_version
+    assert db_labels == [-1] * 10
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import ml_processor as ML
+
+
+def _sessions(n, seed=0, shift=0.0):
+    # Two tight groups of sessions, so DBSCAN finds core samples; shift moves every energy value
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        energy = (20.0 if i % 2 else 60.0) + shift + float(rng.normal(0, 0.5))
+        duration = (2.0 if i % 2 else 4.0) + float(rng.normal(0, 0.05))
+        rows.append([
+            i, f"User_{i % 7}", "Tesla Model 3", 75.0, f"ST{i % 5}",
+            "2024-01-08 08:15:00", None,
+            energy, duration, energy / duration, energy * 0.3, "Morning", "Monday",
+            20.0, 80.0, 100.0, 15.0, 2.0
+        ])
+    return rows
+
+
+@pytest.fixture
+def trained(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ML, "_model_cache", {"stamp": None, "bundle": None})
+    monkeypatch.setattr(ML, "_full_cache", {"version": None, "bundle": None})
+    monkeypatch.setitem(ML._online_state, "pending", 0)
+    meta = ML.train_models(_sessions(400))
+    ML.load_models()
+    return meta
+
+
+def test_online_update_meta_has_no_version_of_its_own(trained):
+    meta = ML.partial_fit_models(_sessions(20, seed=1))
+
+    assert "version" not in meta and "created_at" not in meta
+    assert meta["base_version"] == trained["version"]
+    assert meta["source"] == "online"
+
+    saved = ML._save_models(ML._full_cache["bundle"], base_version=trained["version"])
+    assert saved["version"] != trained["version"]
+    assert saved["previous"] == trained["version"]
+    assert "base_version" not in saved
+
+
+def test_online_update_keeps_kd_tree_until_scaler_shifts(trained, monkeypatch):
+    index = ML.load_models()["dbscan_index"]
+    expected = ML.predict_labels(_sessions(50, seed=2))
+
+    ML.partial_fit_models(_sessions(20, seed=3))
+    assert ML.load_models()["dbscan_index"] is index
+    assert ML.predict_labels(_sessions(50, seed=2))[2] == expected[2]
+
+    monkeypatch.setattr(ML, "ONLINE_REINDEX_SHIFT", 0.0)
+    ML.partial_fit_models(_sessions(20, seed=4, shift=5.0))
+    assert ML.load_models()["dbscan_index"] is not index
+    assert "dbscan_scaler" not in ML._full_cache["bundle"]
+
+
+def test_saved_online_update_reindexes_core_samples(trained):
+    ML.partial_fit_models(_sessions(20, seed=5, shift=1.0))
+    bundle = ML._full_cache["bundle"]
+    raw_core = ML._dbscan_core(bundle)[0] * bundle["dbscan_scaler"].scale_ + bundle["dbscan_scaler"].mean_
+
+    ML._save_models(bundle, base_version=trained["version"])
+
+    saved = ML._full_cache["bundle"]
+    assert "dbscan_scaler" not in saved
+    saved_raw = saved["dbscan_core_samples"] * saved["scaler"].scale_ + saved["scaler"].mean_
+    assert np.allclose(saved_raw, raw_core)
+    assert "dbscan_core_mean" not in ML.load_models()
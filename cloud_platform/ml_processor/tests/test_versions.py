@@ -0,0 +1,40 @@
+import json
+import os
+
+import ml_processor as ML
+
+
+def _fake_version(version, source):
+    os.makedirs(ML._version_dir(version))
+    with open(os.path.join(ML._version_dir(version), "meta.json"), "w") as f:
+        json.dump({"source": source}, f)
+
+
+def test_online_snapshots_do_not_prune_trained_versions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ML, "MODEL_KEEP_VERSIONS", 2)
+    monkeypatch.setattr(ML, "MODEL_KEEP_ONLINE_VERSIONS", 3)
+
+    _fake_version("20240101-000000-000000", "train")
+    _fake_version("20240102-000000-000000", "train")
+    online = [f"20240103-0000{i:02d}-000000" for i in range(10)]
+    for version in online:
+        _fake_version(version, "online")
+
+    ML._prune_versions(online[-1])
+
+    assert ML.list_versions() == ["20240101-000000-000000", "20240102-000000-000000"] + online[-3:]
+
+
+def test_legacy_versions_without_source_count_as_trained(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ML, "MODEL_KEEP_VERSIONS", 1)
+    monkeypatch.setattr(ML, "MODEL_KEEP_ONLINE_VERSIONS", 1)
+
+    os.makedirs(ML._version_dir("20230101-000000-000000-legacy"))
+    _fake_version("20240101-000000-000000", "online")
+    _fake_version("20240102-000000-000000", "online")
+
+    ML._prune_versions("20240102-000000-000000")
+
+    assert ML.list_versions() == ["20230101-000000-000000-legacy", "20240102-000000-000000"]